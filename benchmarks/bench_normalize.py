@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""Compares the speed of normalization of texts of warnings.
+
+Creates warnings whose texts repeat a lot (as in real doxygen logs) and
+measures how long it takes to normalize each text twice (once to find out
+whether the warning is new and once to store it) by an uncached regular
+expression and by Warning.text_to_cmp.
+
+Usage: bench_normalize.py [NUMBER_OF_WARNINGS]   (default: 1000000)
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from doxygen_whiner.warning import Warning
+
+TEXTS = [
+    'the following parameters are not documented:\n'
+    "  parameter 'n'\n  parameter 'm'",
+    r'missing argument after \class',
+    'include file error{}.h not found',
+    'documented symbol `Foo::bar{}\' was not declared or defined.',
+    'argument {} of command @param is not found in the argument list',
+]
+
+
+def create_warnings(count):
+    return [Warning('/src/module{}.c'.format(i % 1000), i % 5000 + 1,
+        TEXTS[i % len(TEXTS)].format(i % 100)) for i in range(count)]
+
+
+def measure(name, normalize, warnings):
+    start = time.perf_counter()
+    for warning in warnings:
+        normalize(warning)
+        normalize(warning)
+    duration = time.perf_counter() - start
+    print('{:20} {:>8.2f} s'.format(name, duration))
+    return duration
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000000
+    print('warnings: {}'.format(count))
+    uncached_duration = measure('re.sub',
+        lambda warning: re.sub(r'\b\d+\b', 'XXX', warning.text),
+        create_warnings(count))
+    cached_duration = measure('text_to_cmp',
+        lambda warning: warning.text_to_cmp,
+        create_warnings(count))
+    print('speedup: {:.2f}x'.format(uncached_duration / cached_duration))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""Compares the speed of parsers of the output from doxygen.
+
+Generates a synthetic doxygen log of the given size and measures how long it
+takes to parse it by iter_warnings() and by iter_warnings_mmap().
+
+Usage: bench_parse.py [SIZE_IN_MB]   (default: 1024)
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from doxygen_whiner.warning import iter_warnings
+from doxygen_whiner.warning import iter_warnings_mmap
+
+LOG_CHUNK = '''\
+Generating docs for compound Foo::Bar...
+/src/module{0}/checking.h:{0}: warning: missing argument after \\class
+/src/module{0}/checking.c:{1}: warning: the following parameters are not documented:
+  parameter 'n'
+  parameter 'm'
+/src/module{0}/quick.c:{1}: warning: include file error{0}.h not found
+'''
+
+
+def generate_log(file, size):
+    written = 0
+    i = 0
+    while written < size:
+        chunk = LOG_CHUNK.format(i % 10000, i % 5000 + 1)
+        file.write(chunk)
+        written += len(chunk)
+        i += 1
+
+
+def measure(name, parse):
+    start = time.perf_counter()
+    count = sum(1 for _ in parse())
+    duration = time.perf_counter() - start
+    print('{:20} {:>10} warnings {:>8.2f} s'.format(name, count, duration))
+    return duration
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 1024
+    with tempfile.NamedTemporaryFile('w', suffix='.log') as log:
+        generate_log(log, size * 1024 * 1024)
+        log.flush()
+        print('log size: {} MB'.format(size))
+
+        def parse_stream():
+            with open(log.name) as f:
+                yield from iter_warnings(f)
+
+        stream_duration = measure('iter_warnings', parse_stream)
+        mmap_duration = measure('iter_warnings_mmap',
+            lambda: iter_warnings_mmap(log.name))
+        print('speedup: {:.2f}x'.format(stream_duration / mmap_duration))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
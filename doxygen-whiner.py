@@ -9,26 +9,219 @@
 warnings, and sends emails to users who have introduced the warning."""
 
 import logging
+import os
 import sys
+import time
 import sqlite3
+from contextlib import contextmanager
 from getpass import getpass
-from smtplib import SMTP
-from smtplib import SMTP_SSL
 
 from doxygen_whiner.args import parse as parse_args
 from doxygen_whiner.config import parse as parse_config
-from doxygen_whiner.io import read_file
-from doxygen_whiner.io import read_stdin
-from doxygen_whiner.warning import parse_warnings
+from doxygen_whiner.io import LogTail
+from doxygen_whiner.io import open_input
+from doxygen_whiner.warning import iter_warnings
+from doxygen_whiner.warning import iter_warnings_mmap
 from doxygen_whiner.warning import group_by_culprit
-from doxygen_whiner.git import create_warning_with_culprit
+from doxygen_whiner.warning import is_continued_line
+from doxygen_whiner.git import create_warnings_with_culprit
 from doxygen_whiner.email import create_email
+from doxygen_whiner.delivery import DeliveryError
+from doxygen_whiner.delivery import DryRunBackend
+from doxygen_whiner.delivery import MailboxBackend
+from doxygen_whiner.delivery import MAX_RETRY_DELAY
+from doxygen_whiner.delivery import RETRY_DELAY
+from doxygen_whiner.delivery import SMTPBackend
+from doxygen_whiner.delivery import send_spooled_emails
+from doxygen_whiner.localsmtp import LocalSMTPServer
 from doxygen_whiner.db import Database
+from doxygen_whiner.normalize import parse_rules as parse_normalize_rules
+from doxygen_whiner.normalize import set_rules as set_normalize_rules
+from doxygen_whiner.utils import enable_type_checking
+
+
+def read_warnings(args, tail=None):
+    '''Generates warnings from the input given by the arguments, or from the
+    given LogTail.'''
+    if tail is not None:
+        yield from iter_warnings(tail.lines())
+    elif args.mmap:
+        yield from iter_warnings_mmap(args.file)
+    else:
+        with open_input(args.file) as input_file:
+            yield from iter_warnings(input_file)
+
+
+def get_option(config, section, option, prompt, *, secret=False):
+    '''Returns the value of the given option from the configuration.
+
+    If the option is not set, the user is asked for its value. When there is
+    no user to ask (the standard input is not a terminal), ValueError is
+    raised instead, so unattended runs fail instead of waiting forever.
+    '''
+    value = config[section][option]
+    if value:
+        return value
+    if not sys.stdin.isatty():
+        raise ValueError('option {} in section [{}] is not set'.format(
+            option, section))
+    return getpass(prompt) if secret else input(prompt)
+
+
+@contextmanager
+def open_backend(config):
+    '''Opens the backend by which emails are delivered, as configured.'''
+    backend = config['email'].get('backend', 'smtp')
+    if backend == 'smtp':
+        yield SMTPBackend(
+            get_option(config, 'email', 'server', 'Email server: '),
+            int(get_option(config, 'email', 'port', 'Email server port: ')),
+            use_ssl=config['email'].getboolean('use_ssl'),
+            username=get_option(config, 'email', 'username',
+                'Email server username: '),
+            password=get_option(config, 'email', 'password',
+                'Email server password: ', secret=True))
+    elif backend == 'dry_run':
+        yield DryRunBackend()
+    elif backend in MailboxBackend.FORMATS:
+        yield MailboxBackend(
+            get_option(config, 'email', 'sink_path', 'Mailbox path: '),
+            backend)
+    elif backend == 'local_smtp':
+        # The emails are sent over SMTP to a server in this process, which
+        # stores them into the mailbox (if any).
+        sink = MailboxBackend(config['email']['sink_path']) \
+            if config['email']['sink_path'] else DryRunBackend()
+        sink_connection = sink()
+        try:
+            with LocalSMTPServer(sink_connection.send_message) as server:
+                yield SMTPBackend(*server.address)
+        finally:
+            sink_connection.quit()
+    else:
+        raise ValueError('unknown email backend: {}'.format(backend))
+
+
+def run(args, config, db):
+    '''Processes warnings and sends emails about the new ones.'''
+    # All the options needed to create and send the emails are obtained
+    # before the warnings are processed, so a run with a missing option
+    # fails before doing any work.
+    from_addr = get_option(config, 'email', 'from', 'From address: ')
+    with open_backend(config) as backend:
+        process_warnings(args, config, db, from_addr)
+        send(args, config, db, backend)
+
+
+def process_warnings(args, config, db, from_addr):
+    '''Finds the new warnings and stores emails about them into the
+    outbox.'''
+    # The run begins before blaming, so that the states of the repositories
+    # are stored in it (see the incremental option).
+    db.begin_run()
+
+    # In the tail mode, only the part of the log appended since the last run
+    # is read.
+    tail = None
+    if args.tail:
+        log_path = os.path.abspath(args.file)
+        tail = LogTail(log_path, db.get_log_position(log_path),
+            is_continuation=is_continued_line)
+
+    # The warnings are parsed while they are read, so the output from
+    # doxygen itself is never kept in memory. The parsed warnings are kept,
+    # as the culprits cannot be found before all the warnings from a file
+    # are known, and the new warnings cannot be found before all of them
+    # have their culprits.
+    jobs = args.jobs or config['git'].getint('jobs', 1)
+    all_warnings_with_culprit = list(create_warnings_with_culprit(
+        read_warnings(args, tail), jobs=jobs, cache=db,
+        incremental=config['git'].getboolean('incremental', False)))
+
+    if tail is not None:
+        if tail.restarted:
+            logging.warning('{} has been truncated or replaced, so it has '
+                'been read from the beginning'.format(tail.file_path))
+        db.set_log_position(tail.file_path, tail.position)
+        if not all_warnings_with_culprit:
+            # Nothing has been appended to the log yet, so this run must not
+            # become the last finished run.
+            db.discard_run()
+            return
+
+    # Warnings are new when they were not seen by the last finished run, so
+    # they have to be found before the current run finishes. In the tail
+    # mode, every run sees only a part of the warnings, so they are new when
+    # they were not seen by any run.
+    warnings_with_culprit = db.filter_new_warnings(all_warnings_with_culprit,
+        any_run=tail is not None)
+
+    subject = config['email']['subject']
+    to_addr = config['email']['to']
+    reply_to_addr = config['email']['reply_to']
+
+    # The emails are stored in the outbox together with the warnings, so
+    # the warnings do not have to be processed again when the emails cannot
+    # be sent right away. Such emails are sent later by the send command.
+    db.insert_warnings(all_warnings_with_culprit)
+    max_warnings = config['email'].get('max_warnings')
+    max_size = config['email'].get('max_size')
+    db.spool_emails(create_email(culprit, warnings, from_addr, subject,
+            to_addr=to_addr, reply_to_addr=reply_to_addr,
+            max_warnings=int(max_warnings) if max_warnings else None,
+            max_size=int(max_size) if max_size else None)
+        for culprit, warnings in group_by_culprit(warnings_with_culprit))
+    db.finish_run()
+
+
+def send(args, config, db, backend=None):
+    '''Sends the emails waiting in the outbox by the given backend. If no
+    backend is given, the configured one is opened (see open_backend()).'''
+    if not db.has_due_emails(int(time.time())):
+        return
+
+    if backend is None:
+        with open_backend(config) as backend:
+            return send(args, config, db, backend)
+
+    max_attempts = config['email'].get('max_attempts')
+    failures = 0
+    for email, error in send_spooled_emails(db, backend,
+            connections=config['email'].getint('connections', 1),
+            retry_delay=config['email'].getint('retry_delay', RETRY_DELAY),
+            max_retry_delay=config['email'].getint('max_retry_delay',
+                MAX_RETRY_DELAY),
+            max_attempts=int(max_attempts) if max_attempts else None):
+        if error is None:
+            logging.info('email sent to {}'.format(email['To']))
+        else:
+            failures += 1
+            logging.error('email to {} not sent: {}: {}'.format(
+                email['To'], error.__class__.__name__, error))
+    # The emails that have not been sent stay in the outbox and are retried
+    # by the next send command.
+    if failures:
+        raise DeliveryError('{} emails not sent'.format(failures))
+
+
+def prune(args, config, db):
+    '''Deletes the old history from the database and compacts it.'''
+    # The retention period is not limited when the option is empty.
+    retention_days = args.retention_days or \
+        int(config['db'].get('retention_days') or 0)
+    if retention_days:
+        older_than = int(time.time()) - retention_days * 24 * 60 * 60
+        deleted = db.prune(older_than)
+        logging.info('{} warnings not seen for {} days deleted'.format(
+            deleted, retention_days))
+    if db.compact(config['db'].getfloat('vacuum_threshold', 0.25)):
+        logging.info('database compacted')
 
 
 def main(argc, argv):
     args = parse_args(argv)
     config = parse_config("config.ini", "config.local.ini")
+    enable_type_checking(args.debug)
 
     if config['logging'].getboolean('enabled'):
         logging.basicConfig(
@@ -40,44 +233,27 @@ def main(argc, argv):
         argv[0], ' '.join(argv[1:])))
 
     try:
-        if args.file:
-            text = read_file(args.file)
-        else:
-            text = read_stdin()
-
-        warnings = parse_warnings(text)
-        all_warnings_with_culprit = list(map(create_warning_with_culprit, warnings))
-
-        with sqlite3.connect(config['db']['path']) as db_conn:
-            db = Database(db_conn)
-            # Do not use filter() because we need the filtered warnings right
-            # away, before db.make_all_warnings_old() is called.
-            warnings_with_culprit = [w for w in all_warnings_with_culprit
-                                     if not db.has_warning(w)]
-            db.make_all_warnings_old()
-
-            server = config['email']['server'] or input('Email server: ')
-            port = config['email']['port'] or input('Email server port: ')
-            use_ssl = config['email'].getboolean('use_ssl')
-            username = config['email']['username'] or input('Email server username: ')
-            password = config['email']['password'] or getpass('Email server password: ')
-
-            from_addr = config['email']['from'] or input('From address: ')
-            subject = config['email']['subject']
-            to_addr = config['email']['to']
-            reply_to_addr = config['email']['reply_to']
-
-            SMTPServer = SMTP_SSL if use_ssl else SMTP
-            with SMTPServer(server, port) as smtp_server:
-                smtp_server.login(username, password)
-                for culprit, warnings in group_by_culprit(warnings_with_culprit):
-                    email = create_email(culprit, warnings, from_addr, subject,
-                        to_addr=to_addr, reply_to_addr=reply_to_addr)
-                    smtp_server.send_message(email)
-                    logging.info('email sent to {}'.format(email['To']))
-
-            for w in all_warnings_with_culprit:
-                db.insert_warning(w)
+        if config.has_section('normalize'):
+            set_normalize_rules(parse_normalize_rules(config['normalize']))
+
+        with sqlite3.connect(config['db']['path'],
+                timeout=config['db'].getfloat('timeout', 5)) as db_conn:
+            db = Database(db_conn,
+                blame_cache_size=config['db'].getint('blame_cache_size'),
+                batch_size=config['db'].getint('batch_size',
+                    Database.DEFAULT_BATCH_SIZE),
+                pragmas={name: config['db'][name] for name in Database.PRAGMAS
+                    if config['db'].get(name)})
+            logging.info('database settings: {}'.format(', '.join(
+                '{} = {}'.format(name, value)
+                for name, value in db.get_pragmas().items())))
+
+            if args.command == 'prune':
+                prune(args, config, db)
+            elif args.command == 'send':
+                send(args, config, db)
+            else:
+                run(args, config, db)
 
     except Exception as ex:
         logging.error('{}: {}'.format(ex.__class__.__name__, str(ex)))
@@ -9,10 +9,58 @@
 
 import argparse
 
+# The command that is used when no command is given.
+DEFAULT_COMMAND = "run"
+
 
 def parse(argv):
     parser = argparse.ArgumentParser(prog=argv[0])
-    parser.add_argument("file", help="load warnings from the given file",
-                        nargs="?", default=None)
-    parsed_args = parser.parse_args(argv[1:])
+    parser.add_argument("--debug", help="check types of attributes of the "
+                        "created objects (slow)", action="store_true")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+
+    run_parser = subparsers.add_parser("run", help="process warnings, add "
+                                       "emails about new ones to the outbox, "
+                                       "and send them (default)")
+    run_parser.add_argument("file", help="load warnings from the given file",
+                            nargs="?", default=None)
+    run_parser.add_argument("-j", "--jobs", help="number of files blamed "
+                            "concurrently (overrides the configuration)",
+                            type=int, default=None)
+    run_parser.add_argument("--mmap", help="memory-map the given file and "
+                            "parse it as a whole (faster for large files)",
+                            action="store_true")
+    run_parser.add_argument("--tail", help="read only the part of the given "
+                            "file appended since the last run (for logs "
+                            "that only grow)", action="store_true")
+    run_parser.add_argument("--debug", help=argparse.SUPPRESS,
+                            action="store_true", default=argparse.SUPPRESS)
+
+    send_parser = subparsers.add_parser("send", help="send emails that "
+                                        "are waiting in the outbox")
+    send_parser.add_argument("--debug", help=argparse.SUPPRESS,
+                             action="store_true", default=argparse.SUPPRESS)
+
+    prune_parser = subparsers.add_parser("prune", help="delete warnings "
+                                         "that have not been seen for a long "
+                                         "time and compact the database")
+    prune_parser.add_argument("--retention-days", help="number of days for "
+                              "which warnings are kept (overrides the "
+                              "configuration)", type=int, default=None)
+    prune_parser.add_argument("--debug", help=argparse.SUPPRESS,
+                              action="store_true", default=argparse.SUPPRESS)
+
+    # For backward compatibility, the run command may be omitted.
+    args = argv[1:]
+    first_arg = next((arg for arg in args if arg != "--debug"), None)
+    if first_arg not in set(subparsers.choices) | {"-h", "--help"}:
+        args = [DEFAULT_COMMAND] + args
+    parsed_args = parser.parse_args(args)
+    if parsed_args.command == "run":
+        if parsed_args.mmap and parsed_args.file is None:
+            run_parser.error("--mmap requires a file")
+        if parsed_args.tail and parsed_args.file is None:
+            run_parser.error("--tail requires a file")
+        if parsed_args.tail and parsed_args.mmap:
+            run_parser.error("--tail cannot be used with --mmap")
     return parsed_args
@@ -9,13 +9,72 @@
 
 import re
 import time
+import hashlib
+import sqlite3
+
+from .utils import batched
+from .warning import Person
+
+
+def compute_fingerprint(file, text_to_cmp, name, email):
+    '''Returns a fingerprint of a warning with the given data.
+
+    The fingerprint is a 64-bit signed integer (the largest integer type of
+    SQLite) computed from a hash of the data. Missing data are treated as
+    empty strings.
+    '''
+    data = '\0'.join(field or '' for field in (file, text_to_cmp, name, email))
+    digest = hashlib.blake2b(data.encode('utf-8', 'surrogatepass'),
+        digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
 
 
 class Database:
-    def __init__(self, conn):
+    # SQLite versions prior to 3.32.0 do not allow more than 999 parameters.
+    _MAX_QUERY_PARAMS = 999
+
+    # The default number of warnings inserted by a single statement.
+    DEFAULT_BATCH_SIZE = 1000
+
+    # Pragmas that can be used to tune the performance of the database (see
+    # https://www.sqlite.org/pragma.html). For example, journal_mode = WAL
+    # allows reading from the database while warnings are being inserted.
+    PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+        'temp_store')
+
+    # Pragmas cannot be set by query parameters, so their values are
+    # restricted to (possibly negative) numbers and identifiers.
+    _PRAGMA_VALUE_RE = re.compile(r'^-?\w+$')
+
+    def __init__(self, conn, *, blame_cache_size=None,
+            batch_size=DEFAULT_BATCH_SIZE, pragmas=None):
         self.conn = conn
+        self.blame_cache_size = blame_cache_size
+        self.batch_size = batch_size
+        # The current run (see begin_run()).
+        self.run = None
+        self._set_pragmas(pragmas or {})
         self._initialize_table()
 
+    def _set_pragmas(self, pragmas):
+        for name, value in pragmas.items():
+            if name not in self.PRAGMAS:
+                raise ValueError('unsupported pragma: {}'.format(name))
+            value = str(value)
+            if not self._PRAGMA_VALUE_RE.match(value):
+                raise ValueError('invalid value of pragma {}: {}'.format(
+                    name, value))
+            # Some pragmas (e.g. journal_mode) return their new value, so
+            # the result has to be fetched for the statement to finish.
+            self.conn.execute('PRAGMA {} = {};'.format(name, value)).fetchall()
+
+    def get_pragmas(self):
+        '''Returns a dictionary with the values of the pragmas from PRAGMAS
+        that are currently in effect.'''
+        return {name: self.conn.execute(
+                'PRAGMA {};'.format(name)).fetchone()[0]
+            for name in self.PRAGMAS}
+
     def _initialize_table(self):
         # The new column is, in fact, of the Boolean type (sqlite3 does not
         # support the Boolean type, so we use the Integer type).
@@ -30,46 +89,668 @@ class Database:
                 date INT,
                 new INTEGER DEFAULT 1);
         ''')
+        self._create_blame_cache()
         self.conn.commit()
 
-    def _get_text_to_cmp(self, text):
-        return re.sub(r'\b\d+\b', 'XXX', text)
+        # Databases created by older versions are migrated to the current
+        # schema. The version of the schema is stored in user_version.
+        version = self.conn.execute('PRAGMA user_version;').fetchone()[0]
+        vacuum = False
+        for version, migrate in enumerate(self._MIGRATIONS[version:],
+                start=version + 1):
+            # Every migration runs in a transaction of its own, together
+            # with the update of the version, so an interrupted migration
+            # leaves the database at the previous version. The transaction
+            # has to be begun explicitly, as sqlite3 does not begin one
+            # before statements altering the schema.
+            self.conn.execute('BEGIN;')
+            try:
+                vacuum = migrate(self) or vacuum
+                self.conn.execute('PRAGMA user_version = {};'.format(version))
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+        if vacuum:
+            # VACUUM cannot be run inside a transaction, so it is run after
+            # the migrations have been committed.
+            self.conn.execute('VACUUM;')
 
-    def insert_warning(self, warning):
+    def _create_blame_cache(self):
+        # Culprits of lines are cached by the file and the id of the git
+        # blob of its contents, so a cached culprit is valid for as long as
+        # the contents of the file stay the same. Files with the same
+        # contents share the blob, but their lines may have been written by
+        # different persons (e.g. a copied file), so the blob alone is not
+        # enough. The date is the time of the last use.
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS blame_cache (
+                file TEXT,
+                blob TEXT,
+                line INTEGER,
+                name TEXT,
+                email TEXT,
+                date INT,
+                PRIMARY KEY (file, blob, line));
+        ''')
+
+    def _add_fingerprints(self):
+        # Warnings are compared by a fingerprint of their data, so lookups
+        # of warnings are index probes rather than full table scans.
+        self.conn.create_function('fingerprint', 4, compute_fingerprint,
+            deterministic=True)
+        self.conn.execute('''
+            ALTER TABLE warnings ADD COLUMN fingerprint INTEGER;
+        ''')
+        self.conn.execute('''
+            UPDATE warnings
+                SET fingerprint = fingerprint(file, text_to_cmp, name, email);
+        ''')
+        self.conn.execute('''
+            CREATE INDEX warnings_fingerprint ON warnings (fingerprint, new);
+        ''')
+
+    def _make_fingerprints_unique(self):
+        # Every warning is stored only once. Previously, a new row was added
+        # whenever a warning was seen, so duplicate rows have to be merged:
+        # the latest row is kept, with the date when the warning was first
+        # and last seen.
+        self.conn.execute('''
+            ALTER TABLE warnings ADD COLUMN last_seen INT;
+        ''')
+        self.conn.execute('''
+            UPDATE warnings SET
+                last_seen = (SELECT MAX(w.date) FROM warnings AS w
+                    WHERE w.fingerprint = warnings.fingerprint),
+                date = (SELECT MIN(w.date) FROM warnings AS w
+                    WHERE w.fingerprint = warnings.fingerprint),
+                new = (SELECT MAX(w.new) FROM warnings AS w
+                    WHERE w.fingerprint = warnings.fingerprint)
+            WHERE fingerprint IS NOT NULL;
+        ''')
+        cursor = self.conn.execute('''
+            DELETE FROM warnings
+            WHERE fingerprint IS NOT NULL
+                AND rowid NOT IN (SELECT MAX(rowid) FROM warnings
+                    GROUP BY fingerprint);
+        ''')
+        merged_rows = cursor.rowcount
+        self.conn.execute('''
+            DROP INDEX warnings_fingerprint;
+        ''')
+        self.conn.execute('''
+            CREATE UNIQUE INDEX warnings_fingerprint ON warnings (fingerprint);
+        ''')
+        self.conn.execute('''
+            CREATE INDEX warnings_new ON warnings (new, fingerprint);
+        ''')
+        # The space taken by the duplicate rows is given back to the file
+        # system once the migration is finished.
+        return merged_rows > 0
+
+    def _add_runs(self):
+        # Instead of marking warnings as new (which needs to update every
+        # row at the start of each run), every warning remembers the last
+        # run in which it was seen. The current warnings are those that were
+        # seen in the last finished run.
+        self.conn.execute('''
+            CREATE TABLE runs (
+                id INTEGER PRIMARY KEY,
+                started INT,
+                finished INT);
+        ''')
         self.conn.execute('''
-            INSERT INTO warnings (file, line, text, text_to_cmp, name, email, date)
-                VALUES (?, ?, ?, ?, ?, ?, ?);''',
-            (warning.file,
-             warning.line,
-             warning.text,
-             self._get_text_to_cmp(warning.text),
-             warning.culprit.name,
-             warning.culprit.email,
-             int(time.time())
+            ALTER TABLE warnings ADD COLUMN last_seen_run INTEGER;
+        ''')
+        # The warnings marked as new were seen in the last run.
+        cursor = self.conn.execute('SELECT 1 FROM warnings WHERE new = 1;')
+        if cursor.fetchone():
+            date = int(time.time())
+            cursor = self.conn.execute('''
+                INSERT INTO runs (started, finished) VALUES (?, ?);''',
+                (date, date)
+            )
+            self.conn.execute('''
+                UPDATE warnings SET last_seen_run = ? WHERE new = 1;''',
+                (cursor.lastrowid,)
             )
+        self.conn.execute('''
+            DROP INDEX warnings_new;
+        ''')
+        self.conn.execute('''
+            CREATE INDEX warnings_last_seen_run
+                ON warnings (last_seen_run, fingerprint);
+        ''')
+        # Columns can be dropped since SQLite 3.35.0. In older versions, the
+        # column is kept, but it is not used anymore.
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            self.conn.execute('''
+                ALTER TABLE warnings DROP COLUMN new;
+            ''')
+
+    def _add_outbox(self):
+        # Emails waiting to be sent (see spool_emails()). The message column
+        # contains the whole rendered email. When the next_attempt column is
+        # NULL, no more attempts to send the email are made.
+        self.conn.execute('''
+            CREATE TABLE outbox (
+                id INTEGER PRIMARY KEY,
+                recipient TEXT,
+                message TEXT,
+                created INT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt INT,
+                last_error TEXT);
+        ''')
+        self.conn.execute('''
+            CREATE INDEX outbox_next_attempt ON outbox (next_attempt);
+        ''')
+
+    def _add_repository_states(self):
+        # States of repositories in which warnings were blamed by runs (see
+        # store_repository_state()). The paths of dirty files are separated
+        # by null characters.
+        self.conn.execute('''
+            CREATE TABLE repository_states (
+                run INTEGER,
+                repository TEXT,
+                head TEXT,
+                dirty_files TEXT,
+                PRIMARY KEY (repository, run));
+        ''')
+
+    def _add_log_positions(self):
+        # Positions in log files where their reading ended (see
+        # io.LogTail).
+        self.conn.execute('''
+            CREATE TABLE log_positions (
+                path TEXT PRIMARY KEY,
+                device INTEGER,
+                inode INTEGER,
+                offset INTEGER,
+                last_bytes BLOB);
+        ''')
+
+    def _scope_blame_cache_by_file(self):
+        # The cache used to be keyed only by blobs. It can be rebuilt by
+        # blaming the files again, so the old entries are dropped.
+        self.conn.execute('''
+            DROP TABLE blame_cache;
+        ''')
+        self._create_blame_cache()
+
+    # Migrations of the schema, in the order of versions. A migration returns
+    # true if the database should be vacuumed after it.
+    _MIGRATIONS = [
+        _add_fingerprints,
+        _make_fingerprints_unique,
+        _add_runs,
+        _add_outbox,
+        _add_repository_states,
+        _add_log_positions,
+        _scope_blame_cache_by_file,
+    ]
+
+    def _get_fingerprint(self, warning):
+        # While comparing we do not take into consideration the line number
+        # and original text. Instead, we use text_to_cmp.
+        return compute_fingerprint(
+            warning.file,
+            warning.text_to_cmp,
+            warning.culprit.name,
+            warning.culprit.email
+        )
+
+    def _get_row(self, warning, date):
+        return (warning.file,
+                warning.line,
+                warning.text,
+                warning.text_to_cmp,
+                warning.culprit.name,
+                warning.culprit.email,
+                date,
+                date,
+                self.run,
+                self._get_fingerprint(warning))
+
+    def begin_run(self):
+        '''Begins a new run. Warnings inserted from now on are considered to
+        be seen in this run.'''
+        cursor = self.conn.execute('''
+            INSERT INTO runs (started) VALUES (?);''',
+            (int(time.time()),)
         )
         self.conn.commit()
+        self.run = cursor.lastrowid
+
+    def finish_run(self):
+        '''Finishes the current run. The warnings seen in this run become the
+        current warnings, and all the other warnings become old.
+
+        All the changes made during the run that have not been committed yet
+        (e.g. by insert_warnings()) are committed together with the end of
+        the run.
+        '''
+        self.conn.execute('''
+            UPDATE runs SET finished = ? WHERE id = ?;''',
+            (int(time.time()), self.run)
+        )
+        self.conn.commit()
+        self.run = None
+
+    def discard_run(self):
+        '''Discards the current run, which has seen no warnings, so that it
+        does not become the last finished run. The other changes made during
+        the run are committed, like by finish_run().'''
+        self.conn.execute('''
+            DELETE FROM repository_states WHERE run = ?;''',
+            (self.run,)
+        )
+        self.conn.execute('''
+            DELETE FROM runs WHERE id = ?;''',
+            (self.run,)
+        )
+        self.conn.commit()
+        self.run = None
+
+    def _get_last_finished_run(self):
+        cursor = self.conn.execute('''
+            SELECT MAX(id) FROM runs WHERE finished IS NOT NULL;'''
+        )
+        return cursor.fetchone()[0]
+
+    def insert_warning(self, warning):
+        self.insert_warnings([warning])
+
+    def insert_warnings(self, warnings):
+        '''Inserts the given warnings, seen in the current run.
+
+        A warning that is already stored is not inserted again. Instead, its
+        line, text, date of the last occurrence and the last run in which it
+        was seen are updated. If no run has begun, a new one is begun.
+
+        The warnings are taken from the given iterable in batches of
+        batch_size warnings. They are not committed, so they are committed
+        together with the current run by finish_run(). This way, a run that
+        does not finish (e.g. it is killed) changes no warnings, and the
+        warnings it has seen are still current in the next run. If an
+        exception is raised, the transaction is rolled back.
+        '''
+        if self.run is None:
+            self.begin_run()
+        date = int(time.time())
+        try:
+            for batch in batched(warnings, self.batch_size):
+                self.conn.executemany('''
+                    INSERT INTO warnings (file, line, text, text_to_cmp,
+                            name, email, date, last_seen, last_seen_run,
+                            fingerprint)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (fingerprint) DO UPDATE SET
+                        line = excluded.line,
+                        text = excluded.text,
+                        last_seen = excluded.last_seen,
+                        last_seen_run = excluded.last_seen_run;''',
+                    (self._get_row(warning, date) for warning in batch)
+                )
+        except BaseException:
+            self.conn.rollback()
+            raise
 
     def has_warning(self, warning):
-        # While comparing we do not take into consideration the line number and
-        # original text. Instead, we use text_to_cmp.
+        '''Was the given warning seen in the last finished run?'''
         cursor = self.conn.execute('''
-            SELECT * FROM warnings
-            WHERE file = ?
-                AND text_to_cmp = ?
-                AND name = ?
-                AND email = ?
-                AND new = 1;''',
-            (warning.file,
-             self._get_text_to_cmp(warning.text),
-             warning.culprit.name,
-             warning.culprit.email
-            )
+            SELECT 1 FROM warnings
+            WHERE fingerprint = ?
+                AND last_seen_run = ?
+            LIMIT 1;''',
+            (self._get_fingerprint(warning), self._get_last_finished_run())
         )
         return cursor.fetchone() is not None
 
-    def make_all_warnings_old(self):
-        self.conn.execute('UPDATE warnings SET new = 0;')
+    def filter_new_warnings(self, warnings, *, any_run=False):
+        '''Returns a list of the given warnings that were not seen in the
+        last finished run.
+
+        If any_run is true, warnings seen in any run are not new. This is
+        needed when every run sees only a part of the warnings (see
+        io.LogTail), so a warning missing in the last run may still be
+        present.
+
+        Unlike calling has_warning() for each of the warnings, the database
+        is queried only once.
+        '''
+        # The fingerprints are read from the covering index, without
+        # touching the table itself.
+        if any_run:
+            cursor = self.conn.execute('''
+                SELECT fingerprint FROM warnings;'''
+            )
+        else:
+            cursor = self.conn.execute('''
+                SELECT fingerprint FROM warnings
+                WHERE last_seen_run = ?;''',
+                (self._get_last_finished_run(),)
+            )
+        known_fingerprints = {fingerprint for fingerprint, in cursor}
+        return [warning for warning in warnings
+            if self._get_fingerprint(warning) not in known_fingerprints]
 
     def reset(self):
         self.conn.execute('DELETE FROM warnings;')
+        self.conn.execute('DELETE FROM runs;')
+        self.run = None
+        self.conn.execute('DELETE FROM blame_cache;')
+        self.conn.execute('DELETE FROM outbox;')
+        self.conn.execute('DELETE FROM repository_states;')
+        self.conn.execute('DELETE FROM log_positions;')
+
+    def prune(self, older_than):
+        '''Deletes the history that is older than the given date (in seconds
+        since the epoch) and returns the number of deleted warnings.
+
+        Deleted are warnings that have not been seen since the given date,
+        runs that started before it, and culprits in the blame cache that
+        have not been used since it. The warnings seen in the last finished
+        run are never deleted, as they are needed to find new warnings.
+
+        The rows are deleted in batches of batch_size rows, each of them in
+        its own transaction, so the database is never locked for a long
+        time.
+        '''
+        # The runs are numbered in the order in which they started, so
+        # warnings that have not been seen since the date are those whose
+        # last run precedes the first run started after the date. This way,
+        # the index on last_seen_run can be used. Warnings from databases
+        # created before runs were introduced have no run.
+        cursor = self.conn.execute('''
+            SELECT MIN(id) FROM runs
+            WHERE started >= ?
+                OR id = (SELECT MAX(id) FROM runs
+                    WHERE finished IS NOT NULL);''',
+            (older_than,)
+        )
+        first_kept_run = cursor.fetchone()[0]
+        deleted = self._delete_in_batches('warnings', '''
+            last_seen_run < :run
+                OR (last_seen_run IS NULL
+                    AND COALESCE(last_seen, date) < :date)''',
+            {'run': first_kept_run, 'date': older_than}
+        )
+        self._delete_in_batches('runs', 'id < :run',
+            {'run': first_kept_run})
+        self._delete_in_batches('repository_states', 'run < :run',
+            {'run': first_kept_run})
+        self._delete_in_batches('blame_cache', 'date < :date',
+            {'date': older_than})
+        return deleted
+
+    def _delete_in_batches(self, table, condition, params):
+        # Deletes rows satisfying the given condition from the given table
+        # and returns their number.
+        deleted = 0
+        while True:
+            cursor = self.conn.execute('''
+                DELETE FROM {0} WHERE rowid IN (
+                    SELECT rowid FROM {0} WHERE {1} LIMIT :limit);'''.format(
+                    table, condition),
+                dict(params, limit=self.batch_size)
+            )
+            self.conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.batch_size:
+                return deleted
+
+    def compact(self, free_pages_threshold):
+        '''Rebuilds the database when the ratio of its free pages to all its
+        pages exceeds the given threshold (between 0 and 1). Returns whether
+        the database has been rebuilt.
+
+        The database is rebuilt by VACUUM, which releases the free pages, and
+        the statistics used by the query planner are refreshed by ANALYZE.
+        Both of them are expensive for large databases, which is why they
+        are not run every time.
+        '''
+        page_count = self.conn.execute('PRAGMA page_count;').fetchone()[0]
+        free_pages = self.conn.execute('PRAGMA freelist_count;').fetchone()[0]
+        if not page_count or free_pages / page_count <= free_pages_threshold:
+            return False
+        self.conn.commit()
+        self.conn.execute('VACUUM;')
+        self.conn.execute('ANALYZE;')
+        self.conn.commit()
+        return True
+
+    def store_repository_state(self, repository, head, dirty_files):
+        '''Stores the state of the given repository in the current run: the
+        id of its HEAD commit and paths of its files with uncommitted
+        changes. If no run has begun, a new one is begun.'''
+        if self.run is None:
+            self.begin_run()
+        self.conn.execute('''
+            INSERT OR REPLACE INTO repository_states
+                (run, repository, head, dirty_files)
+                VALUES (?, ?, ?, ?);''',
+            (self.run, repository, head, '\0'.join(sorted(dirty_files)))
+        )
+        self.conn.commit()
+
+    def get_last_repository_state(self, repository):
+        '''Returns the state of the given repository stored by the last
+        finished run that has stored it, as a triple (run, head, dirty_files),
+        or None if there is no such run.'''
+        cursor = self.conn.execute('''
+            SELECT run, head, dirty_files FROM repository_states
+                JOIN runs ON runs.id = repository_states.run
+            WHERE repository = ? AND finished IS NOT NULL
+            ORDER BY run DESC
+            LIMIT 1;''',
+            (repository,)
+        )
+        state = cursor.fetchone()
+        if state is None:
+            return None
+        run, head, dirty_files = state
+        return run, head, set(dirty_files.split('\0')) - {''}
+
+    def get_previous_culprits(self, run, files, *, excluded_email=None):
+        '''Returns a dictionary mapping (file, line) pairs to culprits of the
+        warnings in the given files that were seen in the given run.
+
+        Culprits with the given excluded email are not returned (e.g. the
+        culprits of lines that had not been committed, which have to be
+        blamed again).
+        '''
+        culprits = {}
+        files = list(files)
+        # Split the files into chunks to stay below the limit on the number
+        # of parameters of a single query.
+        for i in range(0, len(files), self._MAX_QUERY_PARAMS - 2):
+            chunk = files[i:i + self._MAX_QUERY_PARAMS - 2]
+            cursor = self.conn.execute('''
+                SELECT file, line, name, email FROM warnings
+                WHERE last_seen_run = ?
+                    AND file IN ({})
+                    AND email IS NOT ?;'''.format(
+                    ', '.join('?' * len(chunk))),
+                [run] + chunk + [excluded_email]
+            )
+            for file, line, name, email in cursor:
+                culprits[file, line] = Person(name, email)
+        return culprits
+
+    def get_log_position(self, path):
+        '''Returns the position in the log file with the given path where its
+        reading ended (see io.LogTail), or None if it has not been read.'''
+        cursor = self.conn.execute('''
+            SELECT device, inode, offset, last_bytes FROM log_positions
+            WHERE path = ?;''',
+            (path,)
+        )
+        return cursor.fetchone()
+
+    def set_log_position(self, path, position):
+        '''Stores the position in the log file with the given path where its
+        reading ended (see io.LogTail).
+
+        The position is not committed, so it is committed together with the
+        current run by finish_run(). This way, the log is read again if the
+        run fails.
+        '''
+        self.conn.execute('''
+            INSERT OR REPLACE INTO log_positions
+                (path, device, inode, offset, last_bytes)
+                VALUES (?, ?, ?, ?, ?);''',
+            (path,) + tuple(position)
+        )
+
+    def get_cached_culprits(self, blob_ids):
+        '''Returns a dictionary mapping (file, line) pairs to cached culprits
+        of lines of the given files.
+
+        blob_ids is a dictionary mapping files to ids of blobs of their
+        current contents. Only culprits cached for these blobs are returned.
+        '''
+        culprits = {}
+        files = list(blob_ids)
+        # Split the files into chunks to stay below the limit on the number
+        # of parameters of a single query.
+        for i in range(0, len(files), self._MAX_QUERY_PARAMS):
+            chunk = files[i:i + self._MAX_QUERY_PARAMS]
+            cursor = self.conn.execute('''
+                SELECT file, blob, line, name, email FROM blame_cache
+                WHERE file IN ({});'''.format(', '.join('?' * len(chunk))),
+                chunk
+            )
+            for file, blob_id, line, name, email in cursor:
+                if blob_ids[file] == blob_id:
+                    culprits[file, line] = Person(name, email)
+        return culprits
+
+    def cache_culprits(self, entries):
+        '''Stores the given (file, blob_id, line, culprit) entries into the
+        blame cache.'''
+        date = int(time.time())
+        self.conn.executemany('''
+            INSERT OR REPLACE INTO blame_cache
+                (file, blob, line, name, email, date)
+                VALUES (?, ?, ?, ?, ?, ?);''',
+            ((file, blob_id, line, culprit.name, culprit.email, date)
+                for file, blob_id, line, culprit in entries)
+        )
+        self.conn.commit()
+
+    def prune_cached_culprits(self, blob_ids):
+        '''Evicts stale entries from the blame cache.
+
+        blob_ids is a dictionary mapping files to ids of blobs of their
+        current contents. Entries of older blobs of these files are removed
+        and entries of the current blobs are marked as used. Then, if the
+        cache is larger than blame_cache_size, the least recently used
+        entries are removed.
+        '''
+        date = int(time.time())
+        self.conn.executemany('''
+            DELETE FROM blame_cache WHERE file = ? AND blob != ?;''',
+            blob_ids.items()
+        )
+        self.conn.executemany('''
+            UPDATE blame_cache SET date = ? WHERE file = ? AND blob = ?;''',
+            ((date, file, blob_id) for file, blob_id in blob_ids.items())
+        )
+        if self.blame_cache_size is not None:
+            self.conn.execute('''
+                DELETE FROM blame_cache WHERE rowid IN (
+                    SELECT rowid FROM blame_cache
+                    ORDER BY date DESC
+                    LIMIT -1 OFFSET ?);''',
+                (self.blame_cache_size,)
+            )
+        self.conn.commit()
+
+    def spool_emails(self, emails):
+        '''Stores the given emails into the outbox, from which they are sent
+        later (see claim_due_emails()).
+
+        The emails are not committed, so they are committed together with
+        the current run by finish_run(), like the warnings inserted by
+        insert_warnings(). This way, either both the warnings and the emails
+        about them are stored, or neither of them is. If an exception is
+        raised, the transaction is rolled back.
+        '''
+        date = int(time.time())
+        try:
+            self.conn.executemany('''
+                INSERT INTO outbox (recipient, message, created, next_attempt)
+                    VALUES (?, ?, ?, ?);''',
+                ((email['To'], email.as_string(), date, date)
+                    for email in emails)
+            )
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def claim_due_emails(self, now, lease):
+        '''Claims the emails from the outbox that should be sent at the given
+        time (in seconds since the epoch) and returns a list of triples (id,
+        message, attempts) of them, in the order in which they became due.
+        attempts is the number of failed attempts to send the email.
+
+        The claimed emails are not due again for the given number of
+        seconds, so they are not sent by other processes sending emails at
+        the same time. Each claimed email should be either sent or failed
+        within this time (see email_sent() and email_failed()). If it is not
+        (e.g. the process is killed), it becomes due again.
+        '''
+        # The emails are selected and claimed in a single write transaction,
+        # so no other process can claim them in between. The transaction is
+        # begun explicitly, as sqlite3 would only begin it before the
+        # update. A transaction that is already in progress has written to
+        # the database, so it holds the write lock already.
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE;')
+        try:
+            cursor = self.conn.execute('''
+                SELECT id, message, attempts FROM outbox
+                WHERE next_attempt <= ?
+                ORDER BY next_attempt, id;''',
+                (now,)
+            )
+            emails = cursor.fetchall()
+            self.conn.executemany('''
+                UPDATE outbox SET next_attempt = ? WHERE id = ?;''',
+                ((now + lease, email_id) for email_id, _, _ in emails)
+            )
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return emails
+
+    def email_sent(self, id):
+        '''Removes the sent email with the given id from the outbox.'''
+        self.conn.execute('DELETE FROM outbox WHERE id = ?;', (id,))
+        self.conn.commit()
+
+    def email_failed(self, id, error, next_attempt):
+        '''Records a failed attempt to send the email with the given id.
+
+        The email is sent again at the given time (in seconds since the
+        epoch). If it is None, no more attempts to send the email are made.
+        '''
+        self.conn.execute('''
+            UPDATE outbox
+            SET attempts = attempts + 1, next_attempt = ?, last_error = ?
+            WHERE id = ?;''',
+            (next_attempt, error, id)
+        )
+        self.conn.commit()
+
+    def has_due_emails(self, now):
+        '''Are there emails in the outbox that should be sent at the given
+        time (in seconds since the epoch)?'''
+        cursor = self.conn.execute('''
+            SELECT 1 FROM outbox WHERE next_attempt <= ? LIMIT 1;''',
+            (now,)
+        )
+        return cursor.fetchone() is not None
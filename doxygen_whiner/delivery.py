@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""Delivery of emails.
+
+Emails are delivered by backends. A backend is a callable that opens a new
+connection, which is an object with two methods: send_message(email), which
+sends the given email, and quit(), which closes the connection. A connection
+is used only by the thread that has opened it. Instances of smtplib.SMTP are
+connections, too.
+"""
+
+import mailbox
+import queue
+import threading
+import time
+from email import message_from_string
+from smtplib import SMTP
+from smtplib import SMTP_SSL
+from smtplib import SMTPServerDisconnected
+
+
+# The default delay (in seconds) before the first retry of sending an email
+# that could not be sent. Each following retry waits twice as long, but at
+# most MAX_RETRY_DELAY seconds.
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 6 * 60 * 60
+
+# The time (in seconds) for which emails are claimed by a process sending
+# them (see Database.claim_due_emails()). It should be long enough to send
+# all the due emails.
+SEND_LEASE = 60 * 60
+
+
+# Errors meaning that a connection cannot be used anymore, as opposed to
+# errors concerning a single email (e.g. a refused recipient).
+CONNECTION_ERRORS = (SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class DeliveryError(Exception):
+    pass
+
+
+def send_emails(emails, connect, *, connections=1):
+    '''Sends the given emails and generates pairs (email, error), where error
+    is the exception raised when sending the email, or None if it has been
+    sent.
+
+    connect() is called to open a new connection (e.g. it is a backend, see
+    the description of this module). The emails are sent concurrently over
+    the given number of connections, each of which sends a share of the
+    emails. The pairs are generated in the order in which the emails have
+    been sent.
+
+    If a connection cannot be opened, or it is lost (see
+    CONNECTION_ERRORS), the emails are sent over the other connections. The
+    emails that could not be sent over any connection are reported with the
+    error that has ended the last connection.
+
+    If the number of connections is less than one, ValueError is raised.
+    '''
+    _check_connections(connections)
+    pending = queue.Queue()
+    for email in emails:
+        pending.put(email)
+    count = pending.qsize()
+    # There is no need to connect to the server when there is nothing to
+    # send.
+    connections = min(connections, count)
+
+    # The workers put the pairs into the results queue. When a worker ends,
+    # it puts the error that has ended its connection (or None) into the
+    # queue.
+    results = queue.Queue()
+    for _ in range(connections):
+        threading.Thread(target=_send_emails_over_connection,
+            args=(pending, results, connect), daemon=True).start()
+
+    running = connections
+    connect_error = None
+    while running:
+        result = results.get()
+        if isinstance(result, tuple):
+            yield result
+        else:
+            running -= 1
+            connect_error = result or connect_error
+
+    # The emails that have been left pending could not be sent because no
+    # connection could be opened or all of them have been lost.
+    while not pending.empty():
+        yield pending.get(), connect_error
+
+
+def _check_connections(connections):
+    # Without a connection, no email would be sent, but no error would be
+    # reported either.
+    if connections < 1:
+        raise ValueError('invalid number of connections: {}'.format(
+            connections))
+
+
+def _send_emails_over_connection(pending, results, connect):
+    try:
+        smtp = connect()
+    except Exception as ex:
+        results.put(ex)
+        return
+
+    connection_error = None
+    try:
+        while True:
+            try:
+                email = pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                smtp.send_message(email)
+            except CONNECTION_ERRORS as ex:
+                # The connection has been lost, so the email is left to the
+                # other connections instead of failing all the remaining
+                # emails over this one.
+                pending.put(email)
+                connection_error = ex
+                break
+            except Exception as ex:
+                results.put((email, ex))
+            else:
+                results.put((email, None))
+    finally:
+        try:
+            smtp.quit()
+        except Exception:
+            # All the emails have been handed over to the server, so a
+            # failure to close the connection does not matter.
+            pass
+        results.put(connection_error)
+
+
+class SMTPBackend:
+    '''Sends emails to an SMTP server.
+
+    If a username is given, the user is logged in on every opened
+    connection.
+    '''
+
+    def __init__(self, server, port, *, use_ssl=False, username=None,
+            password=None):
+        self.server = server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+
+    def __call__(self):
+        SMTPServer = SMTP_SSL if self.use_ssl else SMTP
+        smtp = SMTPServer(self.server, self.port)
+        try:
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        return smtp
+
+
+class DryRunBackend:
+    '''Pretends to send emails, but does not send them anywhere.'''
+
+    def __call__(self):
+        return _DryRunConnection()
+
+
+class _DryRunConnection:
+    def send_message(self, email):
+        pass
+
+    def quit(self):
+        pass
+
+
+class MailboxBackend:
+    '''Stores emails into a local mailbox at the given path.
+
+    The format of the mailbox is either 'mbox' or 'maildir'. The mailbox is
+    created if it does not exist. The emails are added to the mailbox one at
+    a time, even if they are sent over multiple connections.
+    '''
+
+    FORMATS = {
+        'mbox': mailbox.mbox,
+        'maildir': mailbox.Maildir,
+    }
+
+    def __init__(self, path, format='mbox'):
+        if format not in self.FORMATS:
+            raise ValueError('unknown mailbox format: {}'.format(format))
+        self._mailbox = self.FORMATS[format](path)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return _MailboxConnection(self._mailbox, self._lock)
+
+
+class _MailboxConnection:
+    def __init__(self, mailbox, lock):
+        self._mailbox = mailbox
+        self._lock = lock
+
+    def send_message(self, email):
+        with self._lock:
+            self._mailbox.add(email)
+
+    def quit(self):
+        with self._lock:
+            self._mailbox.flush()
+
+
+def get_retry_delay(attempts, retry_delay=RETRY_DELAY,
+        max_retry_delay=MAX_RETRY_DELAY):
+    '''Returns the delay (in seconds) before sending an email again after the
+    given number of failed attempts to send it.'''
+    return min(retry_delay * 2 ** (attempts - 1), max_retry_delay)
+
+
+def send_spooled_emails(db, connect, *, connections=1,
+        retry_delay=RETRY_DELAY, max_retry_delay=MAX_RETRY_DELAY,
+        max_attempts=None, lease=SEND_LEASE):
+    '''Sends the due emails from the outbox of the given database (see
+    Database.spool_emails()) and generates pairs (email, error) like
+    send_emails().
+
+    The emails are claimed for the given number of seconds before they are
+    sent, so processes sending emails at the same time never send the same
+    email twice.
+
+    Sent emails are removed from the outbox. Emails that could not be sent
+    are retried later, with the delay growing exponentially with the number
+    of failed attempts (see get_retry_delay()). After max_attempts failed
+    attempts (if given), the email is left in the outbox, but no more
+    attempts to send it are made.
+    '''
+    # The number of connections is checked before the emails are claimed,
+    # so they are not held back by an invalid configuration.
+    _check_connections(connections)
+    now = int(time.time())
+    # The sent emails are identified by their identity.
+    spooled = {}
+    for email_id, message, attempts in db.claim_due_emails(now, lease):
+        spooled_email = message_from_string(message)
+        spooled[id(spooled_email)] = (spooled_email, email_id, attempts)
+
+    for sent_email, error in send_emails(
+            [spooled_email for spooled_email, _, _ in spooled.values()],
+            connect, connections=connections):
+        _, email_id, attempts = spooled[id(sent_email)]
+        if error is None:
+            db.email_sent(email_id)
+        else:
+            attempts += 1
+            if max_attempts is not None and attempts >= max_attempts:
+                next_attempt = None
+            else:
+                next_attempt = now + get_retry_delay(attempts, retry_delay,
+                    max_retry_delay)
+            db.email_failed(email_id, '{}: {}'.format(
+                error.__class__.__name__, error), next_attempt)
+        yield sent_email, error
@@ -7,23 +7,80 @@
 
 """Creation and sending of emails."""
 
+import gzip
+import io
+from collections import Counter
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+# The name of the attachment with the list of warnings (see create_email()).
+WARNINGS_ATTACHMENT_NAME = 'warnings.txt.gz'
 
-def create_email(culprit, warnings, from_addr, subject, *,
-        to_addr=None, reply_to_addr=None):
-    body = '''Dear {},
 
-you were identified as the author of the code lines on which doxygen reported the following warnings:
+def create_email(culprit, warnings, from_addr, subject, *,
+        to_addr=None, reply_to_addr=None, max_warnings=None, max_size=None):
+    '''Creates an email informing the given culprit about the given
+    warnings.
 
-{}
+    If there are more than max_warnings warnings, or if their list is longer
+    than max_size characters, the body of the email contains only the
+    number of warnings in each file. The full list of warnings is then
+    attached as a gzip-compressed text file.
+    '''
+    # The warnings are written into the list one by one. Once the list
+    # exceeds the limits, it is moved into the compressed attachment, into
+    # which the rest of the warnings is written.
+    warning_list = io.StringIO()
+    warnings_per_file = Counter()
+    attachment = None
+    for count, warning in enumerate(warnings, start=1):
+        warnings_per_file[warning.file] += 1
+        output = warning_list if attachment is None else attachment
+        if count > 1:
+            output.write('\n')
+        output.write(warning.original_data)
+        if attachment is None and (
+                (max_warnings is not None and count > max_warnings) or
+                (max_size is not None and warning_list.tell() > max_size)):
+            attachment_data = io.BytesIO()
+            attachment = io.TextIOWrapper(gzip.GzipFile(
+                fileobj=attachment_data, mode='wb'), encoding='utf-8')
+            attachment.write(warning_list.getvalue())
 
+    body = io.StringIO()
+    body.write('Dear {},\n\n'.format(culprit.name))
+    if attachment is None:
+        body.write('you were identified as the author of the code lines on '
+            'which doxygen reported the following warnings:\n\n')
+        body.write(warning_list.getvalue())
+        body.write('\n')
+    else:
+        body.write('you were identified as the author of the code lines on '
+            'which doxygen reported {} warnings. There are too many of them '
+            'to be listed here, so they are listed in the attached file {}. '
+            'The numbers of the warnings in the files are:\n\n'.format(
+                sum(warnings_per_file.values()), WARNINGS_ATTACHMENT_NAME))
+        for file, file_count in sorted(warnings_per_file.items()):
+            body.write('{}: {}\n'.format(file, file_count))
+    body.write('''
 Please, correct them (if you haven't already done so).
 
     Your Doxygen Whiner
-'''.format(culprit.name, '\n'.join(w.original_data for w in warnings))
+''')
 
-    email = MIMEText(body)
+    if attachment is None:
+        email = MIMEText(body.getvalue())
+    else:
+        attachment.write('\n')
+        # Closing the gzip file does not close the underlying buffer.
+        attachment.close()
+        attached_file = MIMEApplication(attachment_data.getvalue(), 'gzip')
+        attached_file.add_header('Content-Disposition', 'attachment',
+            filename=WARNINGS_ATTACHMENT_NAME)
+        email = MIMEMultipart()
+        email.attach(MIMEText(body.getvalue()))
+        email.attach(attached_file)
     email['Subject'] = subject
     email['From'] = from_addr
     email['To'] = culprit.email if not to_addr else to_addr
@@ -7,18 +7,211 @@
 
 """Interface to git."""
 
-import re
 import os
 import subprocess
+from array import array
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from .warning import Person
+from .warning import PersonRegistry
 from .warning import WarningWithCulprit
 
 
+# The commit that `git blame` reports for lines that have not been committed
+# yet.
+UNCOMMITTED_COMMIT = '0' * 40
+
+# The email of the author that `git blame` reports for lines that have not
+# been committed yet.
+UNCOMMITTED_EMAIL = 'not.committed.yet'
+
+# When a file contains at least this number of lines with warnings, the whole
+# file is blamed at once instead of blaming only the lines with warnings.
+WHOLE_FILE_BLAME_MIN_LINES = 8
+
+
 class GitError(Exception):
     pass
 
 
+class BlameIndex:
+    '''Culprits of lines of a single file, as reported by `git blame`.
+
+    Culprits are stored per commit, and every blamed line refers to its
+    commit by an index into an array, so even a blame of a large file takes
+    little memory.
+    '''
+
+    # Index of lines that have not been blamed.
+    _NOT_BLAMED = -1
+
+    def __init__(self):
+        self._commits = []
+        self._culprits = []
+        self._lines = array('i')
+
+    @classmethod
+    def from_porcelain(cls, lines, persons=None):
+        '''Creates the index from the lines (bytes) of the output from
+        `git blame --porcelain`.
+
+        The lines are processed one by one, so they may be read directly from
+        the output of git. If a PersonRegistry is given, the culprits are
+        shared through it.
+        '''
+        # The output consists of entries of the following form, one for each
+        # blamed line:
+        #
+        # <commit> <original line> <final line> [<lines in group>]
+        # <key> <value> (only when the commit is seen for the first time)
+        # ...
+        # \t<contents of the line>
+        #
+        # Headers are read only for the first line coming from the given
+        # commit. For other lines, they are skipped. The contents of lines
+        # may be in any encoding and contain any characters but a newline,
+        # so they are never decoded. Only the names and emails of authors
+        # are.
+        index = cls()
+        commit_indexes = {}
+        lines = iter(lines)
+        for header in lines:
+            if not header.strip():
+                continue
+            fields = header.split(b' ')
+            commit, final_line = fields[0], int(fields[2])
+            commit_index = commit_indexes.get(commit)
+            if commit_index is None:
+                name = email = None
+                for line in lines:
+                    if line.startswith(b'\t'):
+                        break
+                    elif line.startswith(b'author '):
+                        name = _decode(line[len(b'author '):])
+                    elif line.startswith(b'author-mail '):
+                        email = _decode(line[len(b'author-mail '):])
+                        email = email.strip('<>')
+                culprit = Person(name, email)
+                if persons is not None:
+                    culprit = persons.intern(culprit)
+                commit_index = commit_indexes[commit] = index._add_commit(
+                    commit.decode('ascii'), culprit)
+            else:
+                for line in lines:
+                    if line.startswith(b'\t'):
+                        break
+            index._set_line(final_line, commit_index)
+        return index
+
+    def _add_commit(self, commit, culprit):
+        self._commits.append(commit)
+        self._culprits.append(culprit)
+        return len(self._commits) - 1
+
+    def _set_line(self, line, commit_index):
+        missing_lines = line - len(self._lines)
+        if missing_lines > 0:
+            self._lines.extend([self._NOT_BLAMED] * missing_lines)
+        self._lines[line - 1] = commit_index
+
+    def _get_commit_index(self, line):
+        if 0 < line <= len(self._lines):
+            commit_index = self._lines[line - 1]
+            if commit_index != self._NOT_BLAMED:
+                return commit_index
+        raise KeyError(line)
+
+    def __contains__(self, line):
+        try:
+            self._get_commit_index(line)
+            return True
+        except KeyError:
+            return False
+
+    def culprit(self, line):
+        '''Returns the culprit of the given line.
+
+        If the line has not been blamed, KeyError is raised.
+        '''
+        return self._culprits[self._get_commit_index(line)]
+
+    def is_committed(self, line):
+        '''Has the given line already been committed?
+
+        If the line has not been blamed, KeyError is raised.
+        '''
+        commit = self._commits[self._get_commit_index(line)]
+        return commit != UNCOMMITTED_COMMIT
+
+
+class RepositoryResolver:
+    '''Finds out git repositories to which directories belong.
+
+    `git rev-parse --show-toplevel` is run at most once per directory. Its
+    result is remembered also for all directories between the given one and
+    the top-level directory of the repository, so a directory whose parent
+    has already been resolved is usually resolved without running git.
+    '''
+
+    def __init__(self):
+        self._toplevels = {}
+
+    def resolve(self, dir):
+        '''Returns the top-level directory of the repository to which the
+        given directory belongs.
+
+        If the directory does not exist or it is not in a git repository,
+        GitError is raised.
+        '''
+        dir = os.path.realpath(dir)
+        visited_dirs = []
+        current_dir = dir
+        while current_dir not in self._toplevels:
+            visited_dirs.append(current_dir)
+            parent_dir = os.path.dirname(current_dir)
+            # A directory containing .git is the top-level directory of a
+            # repository (possibly a submodule), so the resolution of its
+            # parents cannot be used.
+            if (os.path.lexists(os.path.join(current_dir, '.git')) or
+                    parent_dir == current_dir):
+                toplevel = self._run_rev_parse(dir)
+                break
+            current_dir = parent_dir
+        else:
+            toplevel = self._toplevels[current_dir]
+
+        for visited_dir in visited_dirs:
+            if _is_in_dir(visited_dir, toplevel):
+                self._toplevels[visited_dir] = toplevel
+        return toplevel
+
+    def _run_rev_parse(self, dir):
+        try:
+            git_output = subprocess.check_output(
+                ['git', 'rev-parse', '--show-toplevel'],
+                cwd=dir, stderr=subprocess.STDOUT)
+        except FileNotFoundError as e:
+            # Either git is not installed or the directory does not exist.
+            raise GitError(str(e))
+        except subprocess.CalledProcessError as e:
+            # The directory is not in a git repository.
+            raise GitError(e.output.decode('utf-8'))
+        return os.path.realpath(git_output.decode('utf-8').rstrip('\n'))
+
+
+def group_by_repository(files, resolver):
+    '''Returns an ordered dictionary mapping top-level directories of
+    repositories to lists of the given files belonging to them.'''
+    files_by_repository = OrderedDict()
+    for file in files:
+        repository = resolver.resolve(os.path.dirname(file) or os.curdir)
+        files_by_repository.setdefault(repository, []).append(file)
+    return files_by_repository
+
+
 def create_warning_with_culprit(warning):
     '''Creates WarningWithCulprit from the given warning.
 
@@ -29,30 +222,287 @@ def create_warning_with_culprit(warning):
     - git is not installed
     - warning.line does not exist in warning.file
     '''
-    current_dir = os.getcwd()
+    blame_index = blame_file(warning.file, {warning.line})
+    return WarningWithCulprit(warning, blame_index.culprit(warning.line))
+
+
+def create_warnings_with_culprit(warnings, *, jobs=1, cache=None,
+        resolver=None, persons=None, incremental=False):
+    '''Generates WarningWithCulprit for each of the given warnings.
+
+    Unlike create_warning_with_culprit(), it runs `git blame` only once per
+    file, and the culprits of all warnings from the file are then taken from
+    the obtained BlameIndex. The files are partitioned by the repositories
+    they belong to (see RepositoryResolver), and up to `jobs` files are
+    blamed concurrently. The results are generated in the same order as the
+    given warnings.
+
+    If `cache` is given (see db.Database), culprits of lines in files whose
+    contents have not changed since they were blamed are taken from it, and
+    newly blamed lines are stored into it.
+
+    If `incremental` is true (and `cache` is given), the state of every
+    repository (its HEAD and the files with uncommitted changes) is stored
+    into the cache for the current run. Files that have not changed since
+    the state stored by the last finished run are not blamed at all.
+    Instead, the culprits of their lines are taken from the warnings found
+    on the same lines by that run.
+
+    All warnings with the same culprit share a single Person instance from
+    `persons` (a PersonRegistry).
+
+    All the given warnings have to be known before any file is blamed (the
+    warnings from a file may be anywhere among them), so they are kept in
+    memory. The memory taken is thus proportional to the number of the
+    warnings, although not to the size of the input they have been parsed
+    from. Each warning is released once its WarningWithCulprit has been
+    generated.
+
+    GitError is raised in the same situations as in
+    create_warning_with_culprit(), and also when a file is not in a git
+    repository.
+    '''
+    warnings = deque(warnings)
+    resolver = resolver or RepositoryResolver()
+    persons = persons or PersonRegistry()
+
+    lines_by_file = OrderedDict()
+    for warning in warnings:
+        lines_by_file.setdefault(warning.file, set()).add(warning.line)
+    files_by_repository = group_by_repository(lines_by_file, resolver)
+
+    culprits_by_file = {file: {} for file in lines_by_file}
+    repository_states = {}
+    if incremental and cache is not None:
+        for repository, files in files_by_repository.items():
+            repository_states[repository] = _get_repository_state(repository)
+            _reuse_previous_culprits(files, repository, cache, lines_by_file,
+                culprits_by_file, persons)
+
+    if cache is not None:
+        # Only files with lines that still have to be blamed are hashed.
+        blob_ids = {}
+        for repository, files in files_by_repository.items():
+            files = [file for file in files if lines_by_file[file]]
+            if files:
+                blob_ids.update(_get_blob_ids(files, repository))
+        cached_culprits = cache.get_cached_culprits(blob_ids)
+        for file, lines in lines_by_file.items():
+            for line in lines:
+                culprit = cached_culprits.get((file, line))
+                if culprit is not None:
+                    culprits_by_file[file][line] = persons.intern(culprit)
+            lines.difference_update(culprits_by_file[file])
+
+    # Blaming is done by git subprocesses, so threads are sufficient to run
+    # it in parallel. Since no blame changes the current working directory,
+    # they can safely run concurrently.
+    files, lines, repositories = [], [], []
+    for repository, repository_files in files_by_repository.items():
+        for file in repository_files:
+            if lines_by_file[file]:
+                files.append(file)
+                lines.append(lines_by_file[file])
+                repositories.append(repository)
+    blame = partial(blame_file, persons=persons)
+    if jobs > 1 and len(files) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            blame_indexes = list(executor.map(blame,
+                files, lines, repositories))
+    else:
+        blame_indexes = list(map(blame, files, lines, repositories))
+
+    new_cache_entries = []
+    for file, blame_index in zip(files, blame_indexes):
+        for line in lines_by_file[file]:
+            culprit = blame_index.culprit(line)
+            culprits_by_file[file][line] = culprit
+            # Lines that have not been committed yet have to be blamed again
+            # once they are committed, even if the contents do not change.
+            if cache is not None and blame_index.is_committed(line):
+                new_cache_entries.append(
+                    (file, blob_ids[file], line, culprit))
+    if cache is not None:
+        cache.cache_culprits(new_cache_entries)
+        cache.prune_cached_culprits(blob_ids)
+    for repository, (head, dirty_files) in repository_states.items():
+        if head is not None:
+            cache.store_repository_state(repository, head, dirty_files)
+
+    while warnings:
+        warning = warnings.popleft()
+        culprit = culprits_by_file[warning.file][warning.line]
+        yield WarningWithCulprit(warning, culprit)
+
+
+def blame_file(file, lines, repository=None, persons=None):
+    '''Runs `git blame` on the given file and returns BlameIndex containing
+    (at least) the given lines.
+
+    If there are only a few lines, only they are blamed. Otherwise, the whole
+    file is blamed. If the top-level directory of the repository of the file
+    is given, git is run in it. Otherwise, it is run in the directory of the
+    file. Culprits are shared through `persons` (a PersonRegistry), if
+    given.
+    '''
+    line_ranges_args = []
+    if len(lines) < WHOLE_FILE_BLAME_MIN_LINES:
+        for first, last in _get_line_ranges(lines):
+            line_ranges_args.extend(['-L', '{},{}'.format(first, last)])
+
+    if repository is not None:
+        cwd, path = repository, _get_path_in_repository(file, repository)
+    else:
+        cwd, path = os.path.dirname(file) or None, os.path.basename(file)
+
+    try:
+        process = subprocess.Popen(
+            ['git', 'blame', path] + line_ranges_args + ['--porcelain'],
+            cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError as e:
+        # Either git is not installed or the directory of the file does not
+        # exist.
+        raise GitError(str(e))
+
+    with process:
+        # The output is read as bytes, so lines are split only by newlines.
+        blame_index = BlameIndex.from_porcelain(process.stdout, persons)
+        error = process.stderr.read()
+    if process.returncode != 0:
+        # Either the file does not exist or some of the lines do not exist
+        # in the file.
+        raise GitError(error.decode('utf-8'))
+
+    # When the whole file is blamed, git does not complain about lines that
+    # are not in the file.
+    missing_lines = sorted(line for line in lines if line not in blame_index)
+    if missing_lines:
+        raise GitError('{}: no such lines: {}'.format(
+            file, ', '.join(map(str, missing_lines))))
+
+    return blame_index
 
+
+def _reuse_previous_culprits(files, repository, cache, lines_by_file,
+        culprits_by_file, persons):
+    # Takes the culprits of lines of the given files that have not changed
+    # since the last finished run from the warnings found by that run, and
+    # removes these lines from lines_by_file.
+    last_state = cache.get_last_repository_state(repository)
+    if last_state is None:
+        return
+    last_run, last_head, last_dirty_files = last_state
+    try:
+        # Files that had uncommitted changes during the last run could have
+        # been changed since then, even if they do not differ from the last
+        # HEAD now.
+        changed_files = _get_changed_files(repository, last_head) | \
+            last_dirty_files
+    except GitError:
+        # The commit is no longer in the repository (e.g. the history has
+        # been rewritten), so all the files are blamed.
+        return
+    unchanged_files = [file for file in files
+        if _get_path_in_repository(file, repository) not in changed_files]
+    # Culprits of lines that had not been committed are not reused, as the
+    # lines may have been committed by someone else since then.
+    previous_culprits = cache.get_previous_culprits(last_run, unchanged_files,
+        excluded_email=UNCOMMITTED_EMAIL)
+    for file in unchanged_files:
+        for line in lines_by_file[file]:
+            culprit = previous_culprits.get((file, line))
+            if culprit is not None:
+                culprits_by_file[file][line] = persons.intern(culprit)
+        lines_by_file[file].difference_update(culprits_by_file[file])
+
+
+def _get_repository_state(repository):
+    '''Returns a pair (head, dirty_files) for the given repository, where
+    head is the id of the current HEAD commit (None if there are no commits)
+    and dirty_files is a set of paths (relative to the top-level directory of
+    the repository) of files with uncommitted changes.'''
+    head = _run_git(['git', 'rev-parse', '--verify', '--quiet', 'HEAD'],
+        repository, check=False).strip()
+    if not head:
+        return None, set()
+    return head, _get_changed_files(repository, head)
+
+
+def _get_changed_files(repository, commit):
+    '''Returns a set of paths (relative to the top-level directory of the
+    given repository) of files that differ between the given commit and the
+    working tree.'''
+    git_output = _run_git(['git', 'diff', '--name-only', '-z', commit, '--'],
+        repository)
+    return set(path for path in git_output.split('\0') if path)
+
+
+def _run_git(args, repository, check=True):
+    # Runs git with the given arguments in the given repository and returns
+    # its standard output. If check is true, GitError is raised when git
+    # fails.
+    try:
+        process = subprocess.run(args, cwd=repository,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError as e:
+        # Git is not installed.
+        raise GitError(str(e))
+    if check and process.returncode != 0:
+        raise GitError(process.stderr.decode('utf-8'))
+    return process.stdout.decode('utf-8')
+
+
+def _get_blob_ids(files, repository):
+    '''Returns a dictionary mapping the given files from the given
+    repository to ids of git blobs corresponding to their current
+    contents.'''
+    # A single git process computes the ids of all the files. Since the ids
+    # are computed from the contents of the files in the working tree, they
+    # also reflect uncommitted changes.
     try:
-        os.chdir(warning.dir)
-        git_output = subprocess.check_output([
-            'git', 'blame', warning.file_name,
-            '-L', '{0},{0}'.format(warning.line),
-            '--porcelain'], stderr=subprocess.STDOUT)
+        git_output = subprocess.check_output(
+            ['git', 'hash-object', '--stdin-paths'],
+            input='\n'.join(_get_path_in_repository(file, repository)
+                for file in files).encode('utf-8'),
+            cwd=repository, stderr=subprocess.STDOUT)
     except FileNotFoundError as e:
-        # Either git is not installed or warning.file does not exist.
+        # Git is not installed.
         raise GitError(str(e))
     except subprocess.CalledProcessError as e:
-        # Error of the form:
-        #
-        # Command 'xxx' returned non-zero exit status N.
+        # One of the files does not exist.
         raise GitError(e.output.decode('utf-8'))
-    finally:
-        os.chdir(current_dir)
 
-    git_output = git_output.decode('utf-8')
+    return dict(zip(files, git_output.decode('utf-8').split()))
+
+
+def _decode(value):
+    '''Decodes the given value from the output of git, which is in UTF-8
+    unless configured otherwise.'''
+    return value.rstrip(b'\n').decode('utf-8', 'replace')
+
+
+def _get_path_in_repository(file, repository):
+    '''Returns the path of the given file relative to the top-level
+    directory of its repository.'''
+    # The top-level directory is a real path, so symbolic links in the path
+    # to the file have to be resolved as well.
+    dir = os.path.realpath(os.path.dirname(file) or os.curdir)
+    return os.path.relpath(os.path.join(dir, os.path.basename(file)),
+        repository)
+
+
+def _is_in_dir(path, dir):
+    '''Is the given path inside the given directory (or equal to it)?'''
+    return path == dir or path.startswith(dir.rstrip(os.sep) + os.sep)
 
-    name_re = re.compile(r'^author (.*)$', re.MULTILINE)
-    email_re = re.compile(r'^author-mail <(.*)>$', re.MULTILINE)
-    name = name_re.search(git_output).group(1)
-    email = email_re.search(git_output).group(1)
 
-    return WarningWithCulprit(warning, Person(name, email))
+def _get_line_ranges(lines):
+    '''Merges the given line numbers into sorted (first, last) ranges of
+    consecutive lines.'''
+    ranges = []
+    for line in sorted(lines):
+        if ranges and ranges[-1][1] + 1 == line:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line])
+    return [tuple(r) for r in ranges]
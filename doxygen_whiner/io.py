@@ -7,7 +7,9 @@
 
 """I/O-related functions."""
 
+import os
 import sys
+from contextlib import contextmanager
 
 
 def read_file(file_path):
@@ -18,3 +20,85 @@ def read_file(file_path):
 def read_stdin():
     return sys.stdin.read()
 
+
+@contextmanager
+def open_input(file_path=None):
+    '''Opens the given file for reading. If no file is given, stdin is
+    used.'''
+    if file_path is None:
+        yield sys.stdin
+    else:
+        with open(file_path) as f:
+            yield f
+
+
+class LogTail:
+    '''The part of a log file appended since the file was read last time.
+
+    The position in the file where reading ended is a tuple (device, inode,
+    offset, last_bytes), where device and inode identify the file, offset is
+    the number of read bytes, and last_bytes are the bytes right before the
+    offset. If the file has been replaced (e.g. rotated) or truncated since
+    the given position, it is read from the beginning.
+
+    Only complete lines are read, so a line that is still being written is
+    read next time. If is_continuation is given, it is called with every
+    line and returns whether the line continues the previous one. The last
+    line is then read next time, together with all the lines continuing it,
+    as more of them may still be written.
+    '''
+
+    # The number of bytes before the offset used to check that the already
+    # read part of the file has not changed.
+    LAST_BYTES_SIZE = 64
+
+    def __init__(self, file_path, position=None, *, is_continuation=None):
+        self.file_path = file_path
+        # The position at which the reading ends, available once all the
+        # lines have been read.
+        self.position = position
+        # Has the file been read from the beginning although a position has
+        # been given?
+        self.restarted = False
+        self._is_continuation = is_continuation
+
+    def lines(self):
+        '''Generates the complete lines appended since the position.'''
+        with open(self.file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            offset = self._get_start_offset(f, stat)
+            f.seek(offset)
+            # The lines are generated once a line that does not continue
+            # them is read. end is the offset of the first line that has not
+            # been generated.
+            end = offset
+            held_lines = []
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                line_text = line.decode('utf-8', 'replace')
+                if self._is_continuation is None or \
+                        not self._is_continuation(line_text):
+                    yield from held_lines
+                    held_lines = []
+                    end = offset
+                held_lines.append(line_text)
+                offset += len(line)
+            if self._is_continuation is None:
+                yield from held_lines
+                end = offset
+            f.seek(max(end - self.LAST_BYTES_SIZE, 0))
+            last_bytes = f.read(min(end, self.LAST_BYTES_SIZE))
+        self.position = (stat.st_dev, stat.st_ino, end, last_bytes)
+
+    def _get_start_offset(self, f, stat):
+        if self.position is None:
+            return 0
+        device, inode, offset, last_bytes = self.position
+        if (device, inode) == (stat.st_dev, stat.st_ino) and \
+                offset <= stat.st_size:
+            f.seek(offset - len(last_bytes))
+            if f.read(len(last_bytes)) == last_bytes:
+                return offset
+        self.restarted = True
+        return 0
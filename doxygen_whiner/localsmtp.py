@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""A local SMTP server, which can stand in for a real one."""
+
+import socketserver
+import threading
+from email import message_from_bytes
+
+
+class LocalSMTPServer:
+    '''A minimal SMTP server that runs in background threads of this
+    process.
+
+    It accepts every sender, recipient and login, and passes every received
+    email to handle_message(email). It can be used to measure the delivery
+    of emails over SMTP without sending them anywhere. The server listens on
+    the given host and port; if the port is 0, a free port is chosen (see
+    the address attribute).
+    '''
+
+    def __init__(self, handle_message, host='localhost', port=0):
+        self._server = _ThreadingTCPServer((host, port), _SMTPHandler)
+        self._server.handle_message = handle_message
+        self._thread = None
+
+    @property
+    def address(self):
+        '''Returns the pair (host, port) on which the server listens.'''
+        return self._server.server_address
+
+    def start(self):
+        '''Starts serving clients in a background thread.'''
+        self._thread = threading.Thread(target=self._server.serve_forever,
+            kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        '''Stops the server.'''
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self._reply('220 localhost SMTP ready')
+        data = None
+        for line in self.rfile:
+            # Lines of an email, terminated by a line with a single dot.
+            if data is not None:
+                if line.rstrip(b'\r\n') == b'.':
+                    self.server.handle_message(message_from_bytes(
+                        b''.join(data)))
+                    data = None
+                    self._reply('250 OK')
+                else:
+                    # Lines starting with a dot have another dot prepended.
+                    # Line endings are converted from the SMTP ones.
+                    if line.startswith(b'..'):
+                        line = line[1:]
+                    data.append(line.rstrip(b'\r\n') + b'\n')
+                continue
+
+            command = line.split(None, 1)[0].upper() if line.strip() else b''
+            if command == b'EHLO':
+                self._reply('250-localhost', '250 AUTH PLAIN')
+            elif command == b'AUTH':
+                self._reply('235 Authentication successful')
+            elif command in (b'HELO', b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self._reply('250 OK')
+            elif command == b'DATA':
+                data = []
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+    def _reply(self, *lines):
+        self.wfile.write(''.join(line + '\r\n' for line in lines).encode())
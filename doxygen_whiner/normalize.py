@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""Normalization of texts of warnings before they are compared."""
+
+import re
+from functools import lru_cache
+
+# The maximal number of distinct texts whose normalized forms are remembered.
+# Texts of warnings repeat a lot (e.g. "the following parameters are not
+# documented"), so most of them are normalized only once.
+CACHE_SIZE = 65536
+
+# The rules used when no rules are configured. Numbers in texts (e.g. line
+# numbers in "see line 25") change often without changing the warning
+# itself, so they are replaced by XXX.
+DEFAULT_RULES = [
+    ('numbers', r'\b\d+\b', 'XXX'),
+]
+
+
+class Normalizer:
+    '''Normalizes texts by the given rules.
+
+    Every rule is a triple (name, pattern, replacement). Parts of a text
+    matching the pattern (a regular expression) of a rule are replaced by
+    the replacement of the rule (a plain string). When patterns of several
+    rules match at the same position, the first rule wins. As the patterns
+    are combined into a single regular expression, they must not contain
+    numbered backreferences (e.g. \\1) or global inline flags (e.g. (?i));
+    flags limited to a group (e.g. (?i:...)) are fine. A name of a group
+    (e.g. (?P<name>...)) must not be used by more than one rule, and names
+    starting with _rule are reserved. Invalid rules raise ValueError.
+    '''
+
+    def __init__(self, rules, cache_size=CACHE_SIZE):
+        # The rules are combined into a single regular expression, in which
+        # each rule has its own named group, so a text is searched only once
+        # regardless of the number of rules. The rule whose pattern has
+        # matched is then identified by the name of the group.
+        self._replacements = {}
+        alternatives = []
+        used_group_names = set()
+        for i, (name, pattern, replacement) in enumerate(rules):
+            group = '_rule{}'.format(i)
+            alternative = '(?P<{}>{})'.format(group, pattern)
+            # The pattern is checked in the form in which it is combined
+            # with the others, so that e.g. global flags are reported here,
+            # together with the name of the rule.
+            try:
+                group_names = re.compile(alternative).groupindex.keys() - \
+                    {group}
+            except re.error as ex:
+                raise ValueError('invalid pattern of rule {}: {}'.format(
+                    name, ex)) from ex
+            invalid_group_names = sorted(group_name
+                for group_name in group_names
+                if group_name.startswith('_rule') or
+                    group_name in used_group_names)
+            if invalid_group_names:
+                raise ValueError('invalid pattern of rule {}: reserved or '
+                    'already used group names: {}'.format(name,
+                    ', '.join(invalid_group_names)))
+            used_group_names.update(group_names)
+            self._replacements[group] = replacement
+            alternatives.append(alternative)
+        try:
+            self._re = re.compile('|'.join(alternatives)) \
+                if alternatives else None
+        except re.error as ex:
+            raise ValueError('invalid normalization rules: {}'.format(
+                ex)) from ex
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def _normalize(self, text):
+        if self._re is None:
+            return text
+        return self._re.sub(self._replace, text)
+
+    def _replace(self, match):
+        return self._replacements[match.lastgroup]
+
+
+def parse_rules(section):
+    '''Returns rules (see Normalizer) from the given configuration section.
+
+    Every option of the section is a rule of the form
+    "name = pattern -> replacement".
+    '''
+    rules = []
+    # The patterns are taken as they are, without interpolation of %.
+    for name in section:
+        pattern, sep, replacement = section.get(name, raw=True).rpartition(
+            '->')
+        if not sep:
+            raise ValueError('invalid rule {}: missing ->'.format(name))
+        rules.append((name, pattern.strip(), replacement.strip()))
+    return rules
+
+
+_normalizer = Normalizer(DEFAULT_RULES)
+
+
+def set_rules(rules):
+    '''Sets the rules used by normalize_text().
+
+    Warnings remember their normalized texts, so the rules should be set
+    before any warning is compared.
+    '''
+    global _normalizer
+    _normalizer = Normalizer(rules)
+
+
+def normalize_text(text):
+    '''Returns the given text of a warning in a form in which it is compared
+    with texts of other warnings.
+
+    The text is normalized by the rules set by set_rules() (DEFAULT_RULES by
+    default). The normalized forms of recently normalized texts are
+    remembered.
+    '''
+    return _normalizer.normalize(text)
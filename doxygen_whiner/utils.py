@@ -7,20 +7,38 @@
 
 """Various utilities."""
 
+from itertools import islice
+
+
+# Checking types of attributes is costly when millions of objects are
+# created, so it is done only when enabled (e.g. in the debug mode).
+_type_checking_enabled = False
+
+
+def enable_type_checking(enabled=True):
+    '''Enables (or disables) checking of types by check_type().'''
+    global _type_checking_enabled
+    _type_checking_enabled = enabled
+
+
+def type_checking_enabled():
+    '''Is checking of types by check_type() enabled?'''
+    return _type_checking_enabled
+
+
+def check_type(value, type):
+    '''Raises TypeError if type checking is enabled and the given value is
+    not of the given type.'''
+    if _type_checking_enabled and not isinstance(value, type):
+        raise TypeError('{!r} is not of type {}'.format(value, type))
+
+
+def batched(iterable, size):
+    '''Generates lists of (at most) the given size from the given
+    iterable.'''
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
 
-class TypeCheckedAttribute:
-    def __init__(self, name, type):
-        self.name = name
-        self.type = type
-
-    def __set__(self, instance, value):
-        if not isinstance(value, self.type):
-            raise TypeError('{!r} is not of type {}'.format(
-                value, self.type))
-        instance.__dict__[self.name] = value
-
-    def __get__(self, instance, cls):
-        if instance is None:
-            return self
-        else:
-            return instance.__dict__[self.name]
@@ -7,27 +7,40 @@
 
 """Representation and parsing of warnings."""
 
+import io
 import re
 import os
-from itertools import groupby
-from operator import attrgetter
+import mmap
 from functools import total_ordering
 
-from .utils import TypeCheckedAttribute
+from .normalize import normalize_text
+from .utils import check_type
+
+
+# Millions of warnings may be created, so the following classes use slots to
+# keep the instances small. Types of their attributes are checked only when
+# type checking is enabled (see utils.enable_type_checking()).
 
 
 class Warning:
-    file = TypeCheckedAttribute('file', str)
-    line = TypeCheckedAttribute('line', int)
-    text = TypeCheckedAttribute('text', str)
+    __slots__ = ('file', 'line', 'text', '_text_to_cmp')
 
     def __init__(self, file, line, text):
+        check_type(file, str)
+        check_type(line, int)
+        check_type(text, str)
         self.file = file
         self.line = line
         self.text = text
+        self._text_to_cmp = None
+
+    def _astuple(self):
+        return (self.file, self.line, self.text)
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Warning):
+            return NotImplemented
+        return self._astuple() == other._astuple()
 
     def __ne__(self, other):
         return not self == other
@@ -46,6 +59,19 @@ class Warning:
         '''Returns the name of the file, without the directory path.'''
         return os.path.basename(self.file)
 
+    @property
+    def text_to_cmp(self):
+        '''Returns the text in the form in which it is compared with texts
+        of other warnings (see normalize.normalize_text()).'''
+        # The text is normalized only once, unless it is changed. The cache
+        # holds the text that has been normalized, so a change is detected
+        # by a cheap identity check.
+        cached = self._text_to_cmp
+        if cached is None or cached[0] is not self.text:
+            cached = self._text_to_cmp = (self.text,
+                normalize_text(self.text))
+        return cached[1]
+
     @property
     def original_data(self):
         '''Returns the data of the original warning.'''
@@ -55,10 +81,11 @@ class Warning:
 
 @total_ordering
 class Person:
-    name = TypeCheckedAttribute('name', str)
-    email = TypeCheckedAttribute('email', str)
+    __slots__ = ('name', 'email')
 
     def __init__(self, name, email):
+        check_type(name, str)
+        check_type(email, str)
         self.name = name
         self.email = email
 
@@ -66,52 +93,220 @@ class Person:
         return 'Person({!r}, {!r})'.format(self.name, self.email)
 
     def __eq__(self, other):
+        # Persons are usually shared (see PersonRegistry), so most of the
+        # comparisons are decided by identity.
+        if self is other:
+            return True
         return (self.name, self.email) == (other.name, other.email)
 
     def __lt__(self, other):
         return (self.name, self.email) < (other.name, other.email)
 
+    # Persons are used as keys when grouping warnings by culprits, so they
+    # must not be changed once they are created.
+    def __hash__(self):
+        return hash((self.name, self.email))
+
+
+class PersonRegistry:
+    '''Shares Person instances having the same name and email.'''
+
+    def __init__(self):
+        self._persons = {}
+
+    def intern(self, person):
+        '''Returns the registered person equivalent to the given one. If
+        there is no such person, the given one is registered and returned.'''
+        # setdefault() is atomic, so the registry can be used from multiple
+        # threads.
+        return self._persons.setdefault((person.name, person.email), person)
+
 
 class WarningWithCulprit(Warning):
+    __slots__ = ('culprit',)
+
     def __init__(self, warning, culprit):
-        self.__dict__.update(warning.__dict__)
+        check_type(culprit, Person)
+        # The attributes of the warning have already been checked.
+        self.file = warning.file
+        self.line = warning.line
+        self.text = warning.text
+        self._text_to_cmp = warning._text_to_cmp
         self.culprit = culprit
 
+    def _astuple(self):
+        return (self.file, self.line, self.text, self.culprit)
+
     def __repr__(self):
         return 'WarningWithCulprit({}, {!r})'.format(
             super().__repr__(), self.culprit)
 
 
-def parse_warnings(text):
-    text = text.strip()
+# A line continuing the previous line (see iter_warnings()).
+_CONTINUED_LINE_RE = re.compile(r'[\t ]+')
+
+def is_continued_line(line):
+    '''Does the given line continue the previous line (see
+    iter_warnings())?'''
+    return _CONTINUED_LINE_RE.match(line) is not None
+
+
+# A warning, possibly spanning over multiple lines.
+_WARNING_RE = re.compile(r'^(.*):(\d+): warning: (.*)$', re.DOTALL)
 
+
+def iter_warnings(lines):
+    '''Generates warnings from the given lines (e.g. from a file object).
+
+    The lines are processed one by one, so only the currently parsed warning
+    is kept in memory.
+    '''
     # There may be warnings spanning over multiple lines, like:
     #
     # /src/checking.h:25: warning: the following parameters are not documented:
     #   parameter 'n'
     #   parameter 'm'
     #
-    # To handle such warnings, we split the text into lines. Then, we merge
-    # lines starting with white space with the previous line. This simplifies
-    # the parsing of such warnings later.
-    lines = []
-    continued_line_re = re.compile(r'[\t ]+')
-    for line in text.split('\n'):
-        match = continued_line_re.match(line)
-        if match:
-            lines[-1] += '\n' + line
-        else:
-            lines.append(line)
-
-    warnings = []
-    warning_re = re.compile(r'^(.*):(\d+): warning: (.*)$', re.DOTALL)
+    # To handle such warnings, we merge lines starting with white space with
+    # the previous line. A warning is parsed once a line that does not
+    # continue it is read.
+    #
+    # Many warnings come from the same file, so they share a single string
+    # with its path.
+    paths = {}
+    current_lines = []
+    # Lines containing only white space may turn out to be trailing white
+    # space at the end of the input, which is not a part of the last
+    # warning. So, they are held back until a line with some text is read.
+    blank_lines = []
     for line in lines:
-        match = warning_re.match(line)
-        if match:
-            file, line, text = match.groups()
-            warnings.append(Warning(file, int(line), text))
+        # Lines read in binary mode (e.g. by io.LogTail) may end with \r\n.
+        line = line.rstrip('\r\n')
+        if not current_lines:
+            # White space at the beginning of the input is ignored.
+            line = line.lstrip()
+            if line:
+                current_lines.append(line)
+            continue
+        if not line.strip():
+            blank_lines.append(line)
+            continue
+        blank_lines.append(line)
+        for line in blank_lines:
+            if _CONTINUED_LINE_RE.match(line):
+                current_lines.append(line)
+            else:
+                warning = _parse_warning('\n'.join(current_lines), paths)
+                if warning is not None:
+                    yield warning
+                current_lines = [line]
+        blank_lines = []
+
+    if current_lines:
+        # Trailing white space at the end of the input is not a part of the
+        # last warning.
+        warning = _parse_warning('\n'.join(current_lines).rstrip(),
+            paths)
+        if warning is not None:
+            yield warning
+
+
+def _parse_warning(text, paths):
+    match = _WARNING_RE.match(text)
+    if match is None:
+        return None
+    file, line, text = match.groups()
+    return Warning(paths.setdefault(file, file), int(line), text)
+
+
+# A warning, possibly spanning over multiple lines, in the bytes of the whole
+# output from doxygen (see iter_warnings_mmap()). A warning starts at the
+# beginning of a line that does not start with white space and continues
+# over all the following lines that start with white space. Lines may end
+# with either \n or \r\n, and the \r is not a part of the warning.
+_WARNING_BYTES_RE = re.compile(
+    rb'^([^\t \r\n][^\r\n]*):(\d+): warning: '
+    rb'([^\r\n]*(?:\r?\n[\t ][^\r\n]*)*)',
+    re.MULTILINE)
+
+
+def iter_warnings_mmap(file_path):
+    '''Generates warnings from the given file.
+
+    Unlike iter_warnings(), the file is memory-mapped and searched for
+    warnings by a single regular expression, and only the parts of the file
+    forming the found warnings are decoded. This is considerably faster for
+    large files.
+    '''
+    with open(file_path, 'rb') as f:
+        # Empty files cannot be memory-mapped.
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Trailing white space at the end of the input is not a part of
+            # the last warning.
+            data_end = len(data)
+            while data_end > 0 and data[data_end - 1:data_end].isspace():
+                data_end -= 1
+
+            # Many warnings come from the same file, so its path is decoded
+            # only once and the warnings share it.
+            paths = {}
+            for match in _WARNING_BYTES_RE.finditer(data, 0, data_end):
+                file, line, text = match.groups()
+                path = paths.get(file)
+                if path is None:
+                    path = paths[file] = file.decode('utf-8', 'replace')
+                # Warnings spanning over multiple lines are joined by \n,
+                # like in iter_warnings().
+                text = text.replace(b'\r\n', b'\n')
+                yield Warning(path, int(line), text.decode('utf-8', 'replace'))
+
+
+def parse_warnings(text):
+    return list(iter_warnings(io.StringIO(text)))
+
+
+class CulpritGrouper:
+    '''Groups warnings with culprits by their culprits.
+
+    Warnings can be added one by one, as they become available (e.g. from
+    git.create_warnings_with_culprit()), and the groups can be obtained at
+    any time.
+    '''
+
+    def __init__(self):
+        # Warnings are grouped in a dictionary keyed by culprits, so each of
+        # them is added in constant time, without sorting all the warnings.
+        self._groups = {}
+
+    def add(self, warning_with_culprit):
+        '''Adds the given warning into the group of its culprit.'''
+        group = self._groups.get(warning_with_culprit.culprit)
+        if group is None:
+            group = self._groups[warning_with_culprit.culprit] = []
+        group.append(warning_with_culprit)
+
+    def add_all(self, warnings_with_culprit):
+        '''Adds all the given warnings (see add()).'''
+        for warning_with_culprit in warnings_with_culprit:
+            self.add(warning_with_culprit)
+
+    def __len__(self):
+        '''Returns the number of culprits.'''
+        return len(self._groups)
+
+    def groups(self):
+        '''Generates pairs of the form (culprit, warnings) for the warnings
+        added so far.
 
-    return warnings
+        The pairs are generated in a sorted order by culprit. The warnings
+        of each culprit are in the order in which they have been added.
+        '''
+        # Only the culprits are sorted, and there are far fewer of them than
+        # warnings.
+        for culprit in sorted(self._groups):
+            yield culprit, list(self._groups[culprit])
 
 
 def group_by_culprit(warnings_with_culprit):
@@ -119,8 +314,6 @@ def group_by_culprit(warnings_with_culprit):
 
     The results are generated in a sorted order by culprit.
     '''
-    warnings_with_culprit = sorted(warnings_with_culprit,
-        key=attrgetter('culprit'))
-    yield from ((culprit, list(warnings))
-        for culprit, warnings in
-            groupby(warnings_with_culprit, key=attrgetter('culprit')))
+    grouper = CulpritGrouper()
+    grouper.add_all(warnings_with_culprit)
+    yield from grouper.groups()
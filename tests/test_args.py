@@ -27,6 +27,67 @@ class TestArgsParse(unittest.TestCase):
         parsed_args = args.parse([PROG_NAME, file])
         self.assertEqual(parsed_args.file, file)
 
+    def test_if_no_jobs_are_given_jobs_is_set_to_none(self):
+        parsed_args = args.parse([PROG_NAME])
+        self.assertEqual(parsed_args.jobs, None)
+
+    def test_if_jobs_are_given_jobs_is_set_to_jobs(self):
+        parsed_args = args.parse([PROG_NAME, "--jobs", "8"])
+        self.assertEqual(parsed_args.jobs, 8)
+        parsed_args = args.parse([PROG_NAME, "-j", "4", "tmp/text"])
+        self.assertEqual(parsed_args.jobs, 4)
+        self.assertEqual(parsed_args.file, "tmp/text")
+
+    def test_mmap_is_not_used_by_default(self):
+        parsed_args = args.parse([PROG_NAME, "tmp/text"])
+        self.assertFalse(parsed_args.mmap)
+
+    def test_mmap_is_used_if_requested(self):
+        parsed_args = args.parse([PROG_NAME, "--mmap", "tmp/text"])
+        self.assertTrue(parsed_args.mmap)
+
+    def test_tail_is_not_used_by_default(self):
+        parsed_args = args.parse([PROG_NAME, "tmp/text"])
+        self.assertFalse(parsed_args.tail)
+
+    def test_tail_is_used_if_requested(self):
+        parsed_args = args.parse([PROG_NAME, "--tail", "tmp/text"])
+        self.assertTrue(parsed_args.tail)
+
+    def test_debug_is_disabled_by_default(self):
+        parsed_args = args.parse([PROG_NAME])
+        self.assertFalse(parsed_args.debug)
+
+    def test_debug_is_enabled_if_requested(self):
+        parsed_args = args.parse([PROG_NAME, "--debug"])
+        self.assertTrue(parsed_args.debug)
+
+    def test_run_command_is_used_by_default(self):
+        parsed_args = args.parse([PROG_NAME, "tmp/text"])
+        self.assertEqual(parsed_args.command, "run")
+        parsed_args = args.parse([PROG_NAME, "--debug"])
+        self.assertEqual(parsed_args.command, "run")
+
+    def test_run_command_can_be_given_explicitly(self):
+        parsed_args = args.parse([PROG_NAME, "run", "-j", "2", "tmp/text"])
+        self.assertEqual(parsed_args.command, "run")
+        self.assertEqual(parsed_args.jobs, 2)
+        self.assertEqual(parsed_args.file, "tmp/text")
+
+    def test_prune_command_is_recognized(self):
+        parsed_args = args.parse([PROG_NAME, "--debug", "prune"])
+        self.assertEqual(parsed_args.command, "prune")
+        self.assertTrue(parsed_args.debug)
+        self.assertEqual(parsed_args.retention_days, None)
+
+    def test_send_command_is_recognized(self):
+        parsed_args = args.parse([PROG_NAME, "send"])
+        self.assertEqual(parsed_args.command, "send")
+
+    def test_if_retention_days_are_given_they_are_set(self):
+        parsed_args = args.parse([PROG_NAME, "prune", "--retention-days", "30"])
+        self.assertEqual(parsed_args.retention_days, 30)
+
     def scenario_parse_args_exits(self, argv):
         with self.assertRaises(SystemExit) as cm:
             stdout = StringIO()
@@ -60,3 +121,13 @@ class TestArgsParse(unittest.TestCase):
             [PROG_NAME, "test1", "test2"])
         self.scenario_error_is_printed_if_invalid_args_are_given(
             [PROG_NAME, "--skl"])
+        self.scenario_error_is_printed_if_invalid_args_are_given(
+            [PROG_NAME, "--jobs", "many"])
+        self.scenario_error_is_printed_if_invalid_args_are_given(
+            [PROG_NAME, "--mmap"])
+        self.scenario_error_is_printed_if_invalid_args_are_given(
+            [PROG_NAME, "prune", "tmp/text"])
+        self.scenario_error_is_printed_if_invalid_args_are_given(
+            [PROG_NAME, "--tail"])
+        self.scenario_error_is_printed_if_invalid_args_are_given(
+            [PROG_NAME, "--tail", "--mmap", "tmp/text"])
@@ -10,6 +10,7 @@
 import sqlite3
 import tempfile
 import unittest
+from email.mime.text import MIMEText
 from unittest import mock
 
 from doxygen_whiner.db import Database
@@ -38,6 +39,128 @@ class TestCreateDatabase(unittest.TestCase):
         self.assertFalse(cursor.fetchone())
 
 
+class TestDatabasePragmas(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(self.temp_dir.name + '/db.sqlite')
+
+    def tearDown(self):
+        self.conn.close()
+        self.temp_dir.cleanup()
+
+    def test_given_pragmas_are_set(self):
+        database = Database(self.conn, pragmas={
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -2048,
+            'temp_store': 'MEMORY'
+        })
+        pragmas = database.get_pragmas()
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 1)
+        self.assertEqual(pragmas['cache_size'], -2048)
+        self.assertEqual(pragmas['temp_store'], 2)
+
+    def test_get_pragmas_returns_all_supported_pragmas(self):
+        database = Database(self.conn)
+        self.assertEqual(set(database.get_pragmas()), set(Database.PRAGMAS))
+
+    def test_unsupported_pragma_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            Database(self.conn, pragmas={'foreign_keys': 'ON'})
+
+    def test_invalid_pragma_value_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            Database(self.conn, pragmas={'cache_size': '1; DROP TABLE x'})
+
+
+class TestMigrateDatabase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        # The schema of the warnings table before any migration.
+        self.conn.execute('''
+            CREATE TABLE warnings (
+                file TEXT,
+                line INTEGER,
+                text TEXT,
+                text_to_cmp TEXT,
+                name TEXT,
+                email TEXT,
+                date INT,
+                new INTEGER DEFAULT 1);
+        ''')
+        self.conn.execute('''
+            INSERT INTO warnings
+                (file, line, text, text_to_cmp, name, email, date)
+                VALUES ('/mnt/data/error.c', 45, 'missing argument 5',
+                    'missing argument XXX', 'John Little',
+                    'john.little@gmail.com', 0);
+        ''')
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_fingerprints_of_existing_warnings_are_computed(self):
+        database = Database(self.conn)
+        warn = Warning('/mnt/data/error.c', 50, 'missing argument 7')
+        culprit = Person('John Little', 'john.little@gmail.com')
+        self.assertTrue(database.has_warning(WarningWithCulprit(warn, culprit)))
+
+    def test_duplicate_warnings_are_merged(self):
+        self.conn.execute('''
+            UPDATE warnings SET new = 0;
+        ''')
+        self.conn.execute('''
+            INSERT INTO warnings
+                (file, line, text, text_to_cmp, name, email, date)
+                VALUES ('/mnt/data/error.c', 50, 'missing argument 7',
+                    'missing argument XXX', 'John Little',
+                    'john.little@gmail.com', 10);
+        ''')
+        Database(self.conn)
+        cursor = self.conn.execute(
+            'SELECT line, date, last_seen FROM warnings;')
+        self.assertEqual(cursor.fetchall(), [(50, 0, 10)])
+
+    def test_blame_cache_is_scoped_by_file(self):
+        self.conn.execute('''
+            CREATE TABLE blame_cache (
+                file TEXT,
+                blob TEXT,
+                line INTEGER,
+                name TEXT,
+                email TEXT,
+                date INT,
+                PRIMARY KEY (blob, line));
+        ''')
+        culprit = Person('John Little', 'john.little@gmail.com')
+        database = Database(self.conn)
+        database.cache_culprits([('/src/a.c', 'blob1', 10, culprit),
+            ('/src/b.c', 'blob1', 10, culprit)])
+        cursor = self.conn.execute('SELECT COUNT(*) FROM blame_cache;')
+        self.assertEqual(cursor.fetchone(), (2,))
+
+    def test_interrupted_migration_is_rolled_back(self):
+        with mock.patch('doxygen_whiner.db.compute_fingerprint',
+                side_effect=RuntimeError('interrupted')):
+            with self.assertRaises(sqlite3.Error):
+                Database(self.conn)
+        self.assertEqual(
+            self.conn.execute('PRAGMA user_version;').fetchone()[0], 0)
+        database = Database(self.conn)
+        warn = Warning('/mnt/data/error.c', 50, 'missing argument 7')
+        culprit = Person('John Little', 'john.little@gmail.com')
+        self.assertTrue(database.has_warning(WarningWithCulprit(warn, culprit)))
+
+    def test_migrations_are_applied_only_once(self):
+        Database(self.conn)
+        version = self.conn.execute('PRAGMA user_version;').fetchone()[0]
+        Database(self.conn)
+        self.assertEqual(
+            self.conn.execute('PRAGMA user_version;').fetchone()[0], version)
+
+
 class BaseForDatabaseOperationsTests(unittest.TestCase):
     def setUp(self):
         self.conn = sqlite3.connect(':memory:')
@@ -54,10 +177,9 @@ class TestResetDatabase(BaseForDatabaseOperationsTests):
         self.assertFalse(cursor.fetchone())
 
 
-def create_warning_with_culprit():
+def create_warning_with_culprit(line=45,
+        text=r'missing argument after \class'):
     file = '/mnt/data/error.c'
-    line = 45
-    text = r'missing argument after \class'
     name = 'John Little'
     email = 'john.little@gmail.com'
     culprit = Person(name, email)
@@ -70,16 +192,122 @@ class TestOperationsWithWarnings(BaseForDatabaseOperationsTests):
         super().setUp()
         self.warn_with_culprit = create_warning_with_culprit()
 
+    def insert_warnings_in_run(self, *warnings):
+        self.database.begin_run()
+        self.database.insert_warnings(warnings)
+        self.database.finish_run()
+
     def test_insert_warning_and_has_warning_work_correctly(self):
-        self.database.insert_warning(self.warn_with_culprit)
+        self.insert_warnings_in_run(self.warn_with_culprit)
         self.assertTrue(self.database.has_warning(self.warn_with_culprit))
 
     @mock.patch('time.time')
     def test_date_is_correctly_set_when_inserting_new_warning(self, mock_time):
         mock_time.return_value = 0
+        self.database.begin_run()
+        mock_time.reset_mock()
         self.database.insert_warning(self.warn_with_culprit)
         mock_time.assert_called_once_with()
 
+    def test_warnings_of_unfinished_run_are_not_current(self):
+        self.database.begin_run()
+        self.database.insert_warning(self.warn_with_culprit)
+        self.assertFalse(self.database.has_warning(self.warn_with_culprit))
+
+    def test_insert_warning_begins_run_if_none_has_begun(self):
+        self.database.insert_warning(self.warn_with_culprit)
+        self.database.finish_run()
+        self.assertTrue(self.database.has_warning(self.warn_with_culprit))
+
+    def test_insert_warnings_inserts_all_warnings_in_batches(self):
+        self.database.batch_size = 2
+        warnings = [create_warning_with_culprit() for _ in range(5)]
+        for line, warning in enumerate(warnings):
+            warning.file = '/mnt/data/error{}.c'.format(line)
+            warning.line = line
+        self.database.insert_warnings(warnings)
+        cursor = self.conn.execute('SELECT line FROM warnings ORDER BY line;')
+        self.assertEqual(cursor.fetchall(), [(i,) for i in range(5)])
+
+    def test_insert_warnings_inserts_nothing_on_failure(self):
+        def warnings():
+            yield self.warn_with_culprit
+            yield self.warn_with_culprit
+            raise RuntimeError('abort')
+        self.database.batch_size = 1
+        with self.assertRaises(RuntimeError):
+            self.database.insert_warnings(warnings())
+        cursor = self.conn.execute('SELECT * FROM warnings;')
+        self.assertFalse(cursor.fetchone())
+
+    def test_warnings_of_interrupted_run_are_still_current(self):
+        warnings = [create_warning_with_culprit(text=text)
+            for text in ('abc', 'def', 'ghi')]
+        self.insert_warnings_in_run(*warnings)
+        self.database.begin_run()
+        self.database.insert_warnings(warnings)
+        # The run is interrupted before it finishes.
+        self.conn.rollback()
+        self.database.run = None
+        self.assertEqual(self.database.filter_new_warnings(warnings), [])
+
+    def test_filter_new_warnings_returns_only_new_warnings(self):
+        self.insert_warnings_in_run(self.warn_with_culprit)
+        new_warning = create_warning_with_culprit()
+        new_warning.text = 'missing parameter'
+        seen_warning = create_warning_with_culprit()
+        seen_warning.line = 875
+        self.assertEqual(
+            self.database.filter_new_warnings([seen_warning, new_warning]),
+            [new_warning])
+
+    def test_filter_new_warnings_ignores_old_warnings(self):
+        self.insert_warnings_in_run(self.warn_with_culprit)
+        self.insert_warnings_in_run()
+        self.assertEqual(
+            self.database.filter_new_warnings([self.warn_with_culprit]),
+            [self.warn_with_culprit])
+
+    def test_filter_new_warnings_in_any_run_ignores_only_unseen_warnings(
+            self):
+        self.insert_warnings_in_run(self.warn_with_culprit)
+        self.insert_warnings_in_run()
+        new_warning = create_warning_with_culprit()
+        new_warning.text = 'missing parameter'
+        self.assertEqual(self.database.filter_new_warnings(
+                [self.warn_with_culprit, new_warning], any_run=True),
+            [new_warning])
+
+    def test_discarded_run_does_not_become_last_finished_run(self):
+        self.insert_warnings_in_run(self.warn_with_culprit)
+        self.database.begin_run()
+        self.database.store_repository_state('/src', 'head1', set())
+        self.database.set_log_position('/log', (1, 2, 30, b'abc'))
+        self.database.discard_run()
+        self.assertTrue(self.database.has_warning(self.warn_with_culprit))
+        self.assertIsNone(self.database.get_last_repository_state('/src'))
+        self.conn.rollback()
+        self.assertEqual(self.database.get_log_position('/log'),
+            (1, 2, 30, b'abc'))
+
+    def test_has_warning_uses_index(self):
+        plan = self.conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT 1 FROM warnings WHERE fingerprint = 1 AND last_seen_run = 1;
+        ''').fetchall()
+        self.assertIn('SEARCH warnings USING', str(plan))
+
+    @mock.patch('time.time')
+    def test_seen_warning_is_updated_instead_of_inserted(self, mock_time):
+        mock_time.return_value = 10
+        self.insert_warnings_in_run(self.warn_with_culprit)
+        mock_time.return_value = 20
+        self.warn_with_culprit.line = 875
+        self.insert_warnings_in_run(self.warn_with_culprit)
+        cursor = self.conn.execute(
+            'SELECT line, date, last_seen, last_seen_run FROM warnings;')
+        self.assertEqual(cursor.fetchall(), [(875, 10, 20, 2)])
+
     def test_has_warning_returns_false_if_there_is_no_warning(self):
         self.assertFalse(self.database.has_warning(self.warn_with_culprit))
 
@@ -87,7 +315,7 @@ class TestOperationsWithWarnings(BaseForDatabaseOperationsTests):
             line1, line2, text_with_line1, text_with_line2):
         self.warn_with_culprit.line = line1
         self.warn_with_culprit.text = text_with_line1
-        self.database.insert_warning(self.warn_with_culprit)
+        self.insert_warnings_in_run(self.warn_with_culprit)
         self.warn_with_culprit.line = line2
         self.warn_with_culprit.text = text_with_line2
         self.assertTrue(self.database.has_warning(self.warn_with_culprit))
@@ -104,16 +332,326 @@ class TestOperationsWithWarnings(BaseForDatabaseOperationsTests):
 
     def test_numbers_in_identifiers_are_not_line_numbers(self):
         self.warn_with_culprit.text = 'parameter dog43'
-        self.database.insert_warning(self.warn_with_culprit)
+        self.insert_warnings_in_run(self.warn_with_culprit)
         self.warn_with_culprit.text = 'parameter dog600'
         self.assertFalse(self.database.has_warning(self.warn_with_culprit))
 
     def test_old_warnings_are_not_considered_during_comparison(self):
-        self.database.insert_warning(self.warn_with_culprit)
-        self.database.make_all_warnings_old()
+        self.insert_warnings_in_run(self.warn_with_culprit)
+        self.insert_warnings_in_run()
         self.assertFalse(self.database.has_warning(self.warn_with_culprit))
 
 
+class TestPruneDatabase(BaseForDatabaseOperationsTests):
+    def setUp(self):
+        super().setUp()
+        self.database.batch_size = 2
+
+    @mock.patch('time.time')
+    def insert_warnings_in_run(self, date, warnings, mock_time):
+        mock_time.return_value = date
+        self.database.begin_run()
+        self.database.insert_warnings(warnings)
+        self.database.finish_run()
+
+    def get_lines_of_stored_warnings(self):
+        cursor = self.conn.execute('SELECT line FROM warnings ORDER BY line;')
+        return [line for line, in cursor]
+
+    def test_warnings_not_seen_since_given_date_are_deleted(self):
+        old_warnings = [create_warning_with_culprit(line=i, text=text)
+            for i, text in enumerate('abcde', start=1)]
+        new_warning = create_warning_with_culprit(line=10, text='new')
+        self.insert_warnings_in_run(10, old_warnings)
+        self.insert_warnings_in_run(20, [new_warning])
+        self.insert_warnings_in_run(30, [new_warning])
+
+        deleted = self.database.prune(15)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(self.get_lines_of_stored_warnings(), [10])
+        cursor = self.conn.execute('SELECT started FROM runs ORDER BY id;')
+        self.assertEqual(cursor.fetchall(), [(20,), (30,)])
+
+    def test_warnings_of_last_finished_run_are_never_deleted(self):
+        warning = create_warning_with_culprit()
+        self.insert_warnings_in_run(10, [warning])
+
+        deleted = self.database.prune(100)
+
+        self.assertEqual(deleted, 0)
+        self.assertTrue(self.database.has_warning(warning))
+
+    def test_warnings_without_run_are_deleted_by_date(self):
+        self.conn.execute('''
+            INSERT INTO warnings (line, date, last_seen)
+                VALUES (1, 0, 10), (2, 0, 20), (3, 30, NULL);''')
+
+        deleted = self.database.prune(25)
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(self.get_lines_of_stored_warnings(), [3])
+
+    def test_unused_culprits_are_deleted_from_blame_cache(self):
+        self.conn.execute('''
+            INSERT INTO blame_cache (file, blob, line, date)
+                VALUES ('a.c', 'a', 1, 10), ('b.c', 'b', 1, 20);''')
+
+        self.database.prune(15)
+
+        cursor = self.conn.execute('SELECT file FROM blame_cache;')
+        self.assertEqual(cursor.fetchall(), [('b.c',)])
+
+
+class TestCompactDatabase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(self.temp_dir.name + '/db.sqlite')
+        self.database = Database(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self.temp_dir.cleanup()
+
+    def create_free_pages(self):
+        self.conn.executemany(
+            'INSERT INTO warnings (text) VALUES (?);',
+            (('x' * 1000,) for _ in range(100))
+        )
+        self.conn.commit()
+        self.conn.execute('DELETE FROM warnings;')
+        self.conn.commit()
+
+    def get_free_pages(self):
+        return self.conn.execute('PRAGMA freelist_count;').fetchone()[0]
+
+    def test_database_is_compacted_when_threshold_is_exceeded(self):
+        self.create_free_pages()
+        self.assertTrue(self.database.compact(0.5))
+        self.assertEqual(self.get_free_pages(), 0)
+
+    def test_database_is_not_compacted_below_threshold(self):
+        self.create_free_pages()
+        self.assertFalse(self.database.compact(0.99))
+        self.assertNotEqual(self.get_free_pages(), 0)
+
+
+class TestBlameCache(BaseForDatabaseOperationsTests):
+    def setUp(self):
+        super().setUp()
+        self.culprit = Person('John Little', 'john.little@gmail.com')
+
+    def test_cached_culprits_are_returned(self):
+        self.database.cache_culprits([
+            ('/src/a.c', 'blob1', 10, self.culprit),
+            ('/src/b.c', 'blob2', 20, self.culprit)])
+        self.assertEqual(
+            self.database.get_cached_culprits({'/src/a.c': 'blob1'}),
+            {('/src/a.c', 10): self.culprit})
+
+    def test_no_culprits_are_returned_for_unknown_blobs(self):
+        self.database.cache_culprits([('/src/a.c', 'blob1', 10, self.culprit)])
+        self.assertEqual(
+            self.database.get_cached_culprits({'/src/a.c': 'blob2'}), {})
+
+    def test_culprits_of_other_files_with_same_blob_are_not_returned(self):
+        self.database.cache_culprits([('/src/a.c', 'blob1', 10, self.culprit)])
+        self.assertEqual(
+            self.database.get_cached_culprits({'/src/b.c': 'blob1'}), {})
+
+    def test_entries_of_older_blobs_of_file_are_pruned(self):
+        self.database.cache_culprits([
+            ('/src/a.c', 'blob1', 10, self.culprit),
+            ('/src/b.c', 'blob2', 20, self.culprit)])
+        self.database.prune_cached_culprits({'/src/a.c': 'blob3'})
+        self.assertEqual(self.database.get_cached_culprits(
+                {'/src/a.c': 'blob1', '/src/b.c': 'blob2'}),
+            {('/src/b.c', 20): self.culprit})
+
+    @mock.patch('time.time')
+    def test_least_recently_used_entries_are_pruned(self, mock_time):
+        self.database.blame_cache_size = 1
+        mock_time.return_value = 0
+        self.database.cache_culprits([
+            ('/src/a.c', 'blob1', 10, self.culprit),
+            ('/src/b.c', 'blob2', 20, self.culprit)])
+        mock_time.return_value = 1
+        self.database.prune_cached_culprits({'/src/a.c': 'blob1'})
+        self.assertEqual(self.database.get_cached_culprits(
+                {'/src/a.c': 'blob1', '/src/b.c': 'blob2'}),
+            {('/src/a.c', 10): self.culprit})
+
+    def test_reset_removes_cached_culprits(self):
+        self.database.cache_culprits([('/src/a.c', 'blob1', 10, self.culprit)])
+        self.database.reset()
+        self.assertEqual(
+            self.database.get_cached_culprits({'/src/a.c': 'blob1'}), {})
+
+
+class TestRepositoryStates(BaseForDatabaseOperationsTests):
+    def test_last_state_is_none_without_runs(self):
+        self.assertIsNone(self.database.get_last_repository_state('/src'))
+
+    def test_state_of_last_finished_run_is_returned(self):
+        self.database.begin_run()
+        self.database.store_repository_state('/src', 'head1', set())
+        self.database.finish_run()
+        self.database.begin_run()
+        self.database.store_repository_state('/src', 'head2',
+            {'a.c', 'b/c.c'})
+        self.database.finish_run()
+        self.database.begin_run()
+        self.database.store_repository_state('/src', 'head3', set())
+        self.assertEqual(self.database.get_last_repository_state('/src'),
+            (2, 'head2', {'a.c', 'b/c.c'}))
+
+    def test_states_of_repositories_are_separate(self):
+        self.database.store_repository_state('/src', 'head1', set())
+        self.database.store_repository_state('/lib', 'head2', set())
+        self.database.finish_run()
+        self.assertEqual(self.database.get_last_repository_state('/lib'),
+            (1, 'head2', set()))
+
+    def test_previous_culprits_are_returned_for_given_files(self):
+        warn1 = create_warning_with_culprit(line=10, text='a')
+        warn2 = create_warning_with_culprit(line=20, text='b')
+        warn2.file = '/mnt/data/other.c'
+        uncommitted = create_warning_with_culprit(line=30, text='c')
+        uncommitted.culprit = Person('Not Committed Yet', 'not.committed.yet')
+        self.database.insert_warnings([warn1, warn2, uncommitted])
+        self.database.finish_run()
+
+        culprits = self.database.get_previous_culprits(1,
+            ['/mnt/data/error.c'], excluded_email='not.committed.yet')
+
+        self.assertEqual(culprits, {('/mnt/data/error.c', 10): warn1.culprit})
+
+    def test_previous_culprits_are_not_excluded_by_default(self):
+        uncommitted = create_warning_with_culprit(line=30, text='c')
+        uncommitted.culprit = Person('Not Committed Yet', 'not.committed.yet')
+        self.database.insert_warnings([uncommitted])
+        self.database.finish_run()
+        self.assertEqual(self.database.get_previous_culprits(1,
+            ['/mnt/data/error.c']),
+            {('/mnt/data/error.c', 30): uncommitted.culprit})
+
+    def test_previous_culprits_of_other_runs_are_not_returned(self):
+        self.database.insert_warnings([create_warning_with_culprit()])
+        self.database.finish_run()
+        self.assertEqual(self.database.get_previous_culprits(2,
+            ['/mnt/data/error.c']), {})
+
+
+class TestLogPositions(BaseForDatabaseOperationsTests):
+    def test_position_is_none_if_not_stored(self):
+        self.assertIsNone(self.database.get_log_position('/log'))
+
+    def test_stored_position_is_returned(self):
+        self.database.set_log_position('/log', (1, 2, 30, b'abc'))
+        self.database.set_log_position('/log', (1, 2, 40, b'def'))
+        self.assertEqual(self.database.get_log_position('/log'),
+            (1, 2, 40, b'def'))
+
+    def test_position_is_committed_by_finished_run(self):
+        self.database.begin_run()
+        self.database.set_log_position('/log', (1, 2, 30, b'abc'))
+        self.database.finish_run()
+        self.conn.rollback()
+        self.assertEqual(self.database.get_log_position('/log'),
+            (1, 2, 30, b'abc'))
+
+    def test_reset_deletes_positions(self):
+        self.database.set_log_position('/log', (1, 2, 30, b'abc'))
+        self.database.reset()
+        self.assertIsNone(self.database.get_log_position('/log'))
+
+
+class TestOutbox(BaseForDatabaseOperationsTests):
+    def create_email(self, to_addr):
+        email = MIMEText('body')
+        email['To'] = to_addr
+        return email
+
+    @mock.patch('time.time')
+    def spool_emails(self, date, emails, mock_time):
+        mock_time.return_value = date
+        self.database.begin_run()
+        self.database.spool_emails(emails)
+        self.database.finish_run()
+
+    def test_spooled_emails_are_due_immediately(self):
+        self.spool_emails(10, [self.create_email('a@b.c'),
+            self.create_email('d@e.f')])
+        self.assertTrue(self.database.has_due_emails(10))
+        due_emails = self.database.claim_due_emails(10, 60)
+        self.assertEqual(len(due_emails), 2)
+        email_id, message, attempts = due_emails[0]
+        self.assertIn('To: a@b.c', message)
+        self.assertEqual(attempts, 0)
+
+    def test_failure_to_spool_emails_rolls_back_warnings(self):
+        def emails():
+            yield self.create_email('a@b.c')
+            raise RuntimeError('abort')
+        self.database.begin_run()
+        self.database.insert_warnings([create_warning_with_culprit()])
+        with self.assertRaises(RuntimeError):
+            self.database.spool_emails(emails())
+        cursor = self.conn.execute('SELECT * FROM warnings;')
+        self.assertFalse(cursor.fetchone())
+        self.assertFalse(self.database.has_due_emails(2 ** 40))
+
+    def test_spooled_emails_are_committed_by_finish_run(self):
+        self.database.begin_run()
+        self.database.spool_emails([self.create_email('a@b.c')])
+        self.conn.rollback()
+        self.assertFalse(self.database.has_due_emails(2 ** 40))
+
+    def test_claimed_emails_are_not_due_until_lease_expires(self):
+        self.spool_emails(10, [self.create_email('a@b.c')])
+        self.assertEqual(len(self.database.claim_due_emails(10, 60)), 1)
+        self.assertEqual(self.database.claim_due_emails(69, 60), [])
+        self.assertFalse(self.database.has_due_emails(69))
+        self.assertEqual(len(self.database.claim_due_emails(70, 60)), 1)
+
+    def test_claimed_emails_are_not_claimed_by_other_connection(self):
+        with tempfile.NamedTemporaryFile() as db_file:
+            conn1 = sqlite3.connect(db_file.name)
+            conn2 = sqlite3.connect(db_file.name)
+            try:
+                database1 = Database(conn1)
+                database2 = Database(conn2)
+                database1.spool_emails([self.create_email('a@b.c')])
+                database1.finish_run()
+                self.assertEqual(len(database1.claim_due_emails(2 ** 40, 60)),
+                    1)
+                self.assertEqual(database2.claim_due_emails(2 ** 40, 60), [])
+            finally:
+                conn1.close()
+                conn2.close()
+
+    def test_sent_email_is_removed(self):
+        self.spool_emails(10, [self.create_email('a@b.c')])
+        email_id, _, _ = self.database.claim_due_emails(10, 60)[0]
+        self.database.email_sent(email_id)
+        self.assertFalse(self.database.has_due_emails(10))
+
+    def test_failed_email_is_due_at_next_attempt(self):
+        self.spool_emails(10, [self.create_email('a@b.c')])
+        email_id, _, _ = self.database.claim_due_emails(10, 60)[0]
+        self.database.email_failed(email_id, 'timeout', 70)
+        self.assertFalse(self.database.has_due_emails(69))
+        self.assertEqual(self.database.claim_due_emails(70, 60)[0][2], 1)
+        cursor = self.conn.execute('SELECT last_error FROM outbox;')
+        self.assertEqual(cursor.fetchone(), ('timeout',))
+
+    def test_failed_email_without_next_attempt_is_never_due(self):
+        self.spool_emails(10, [self.create_email('a@b.c')])
+        email_id, _, _ = self.database.claim_due_emails(10, 60)[0]
+        self.database.email_failed(email_id, 'unknown user', None)
+        self.assertFalse(self.database.has_due_emails(2 ** 40))
+
+
 class TestDatabasePersistence(unittest.TestCase):
     def setUp(self):
         self.db_file = tempfile.NamedTemporaryFile()
@@ -127,6 +665,7 @@ class TestDatabasePersistence(unittest.TestCase):
         database = Database(self.conn)
         warn_with_culprit = create_warning_with_culprit()
         database.insert_warning(warn_with_culprit)
+        database.finish_run()
         self.conn.close()
         self.conn = sqlite3.connect(self.db_file.name)
         database = Database(self.conn)
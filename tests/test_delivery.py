@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""Unit tests for the delivery module."""
+
+import mailbox
+import os
+import smtplib
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from email.mime.text import MIMEText
+from unittest import mock
+
+from doxygen_whiner.db import Database
+from doxygen_whiner.delivery import DryRunBackend
+from doxygen_whiner.delivery import MailboxBackend
+from doxygen_whiner.delivery import SMTPBackend
+from doxygen_whiner.delivery import get_retry_delay
+from doxygen_whiner.delivery import send_emails
+from doxygen_whiner.delivery import send_spooled_emails
+
+
+class FakeSMTP:
+    def __init__(self, failing_emails=()):
+        self.sent_emails = []
+        self.failing_emails = failing_emails
+        self.quit = mock.Mock()
+
+    def send_message(self, email):
+        # The emails are either strings or messages, which are identified by
+        # their recipients.
+        recipient = email if isinstance(email, str) else email['To']
+        if recipient in self.failing_emails:
+            raise smtplib.SMTPRecipientsRefused({recipient: (550, 'unknown')})
+        self.sent_emails.append(email)
+
+
+class TestSendEmails(unittest.TestCase):
+    def test_all_emails_are_sent_over_single_connection(self):
+        smtp = FakeSMTP()
+        results = list(send_emails(['a', 'b', 'c'], lambda: smtp))
+        self.assertEqual(results, [('a', None), ('b', None), ('c', None)])
+        self.assertEqual(smtp.sent_emails, ['a', 'b', 'c'])
+        smtp.quit.assert_called_once_with()
+
+    def test_emails_are_shared_among_connections(self):
+        emails = [str(i) for i in range(100)]
+        smtps = []
+        lock = threading.Lock()
+
+        def connect():
+            with lock:
+                smtps.append(FakeSMTP())
+                return smtps[-1]
+
+        results = list(send_emails(emails, connect, connections=4))
+
+        self.assertEqual(sorted(results), sorted(
+            (email, None) for email in emails))
+        self.assertEqual(len(smtps), 4)
+        self.assertEqual(sorted(email for smtp in smtps
+            for email in smtp.sent_emails), sorted(emails))
+
+    def test_no_connection_is_opened_when_there_are_no_emails(self):
+        connect = mock.Mock()
+        self.assertEqual(list(send_emails([], connect, connections=4)), [])
+        self.assertFalse(connect.called)
+
+    def test_invalid_number_of_connections_raises_value_error(self):
+        connect = mock.Mock(side_effect=FakeSMTP)
+        for connections in (0, -1):
+            with self.assertRaises(ValueError):
+                list(send_emails(['a', 'b'], connect,
+                    connections=connections))
+        self.assertFalse(connect.called)
+
+    def test_emails_stay_in_outbox_if_number_of_connections_is_invalid(
+            self):
+        conn = sqlite3.connect(':memory:')
+        try:
+            database = Database(conn)
+            email = MIMEText('body')
+            email['To'] = 'a@b.c'
+            database.spool_emails([email])
+            database.finish_run()
+            with self.assertRaises(ValueError):
+                list(send_spooled_emails(database, FakeSMTP, connections=0))
+            self.assertTrue(database.has_due_emails(int(time.time())))
+        finally:
+            conn.close()
+
+    def test_at_most_one_connection_is_opened_per_email(self):
+        connect = mock.Mock(side_effect=FakeSMTP)
+        list(send_emails(['a', 'b'], connect, connections=8))
+        self.assertEqual(connect.call_count, 2)
+
+    def test_failed_email_is_reported_and_others_are_sent(self):
+        smtp = FakeSMTP(failing_emails=['b'])
+        results = dict(send_emails(['a', 'b', 'c'], lambda: smtp))
+        self.assertIsNone(results['a'])
+        self.assertIsInstance(results['b'], smtplib.SMTPRecipientsRefused)
+        self.assertIsNone(results['c'])
+
+    def test_emails_are_sent_over_other_connections_if_one_fails(self):
+        smtp = FakeSMTP()
+        connect = mock.Mock(side_effect=[
+            smtplib.SMTPAuthenticationError(535, 'denied'), smtp])
+        results = list(send_emails(['a', 'b', 'c'], connect, connections=2))
+        self.assertEqual(sorted(results), [('a', None), ('b', None),
+            ('c', None)])
+
+    def test_emails_are_sent_over_other_connections_if_one_is_lost(self):
+        # The working connection starts sending only once the lost one has
+        # ended, so the lost one surely takes an email.
+        lost_smtp = FakeSMTP()
+        lost_smtp.send_message = mock.Mock(
+            side_effect=smtplib.SMTPServerDisconnected('lost'))
+        lost_smtp_ended = threading.Event()
+        lost_smtp.quit.side_effect = lambda: lost_smtp_ended.set()
+        smtp = FakeSMTP()
+        send_message = smtp.send_message
+        smtp.send_message = lambda email: (lost_smtp_ended.wait(),
+            send_message(email))
+        smtps = iter([lost_smtp, smtp])
+        lock = threading.Lock()
+
+        def connect():
+            with lock:
+                return next(smtps)
+
+        emails = [str(i) for i in range(100)]
+        results = list(send_emails(emails, connect, connections=2))
+
+        self.assertEqual(sorted(results), sorted(
+            (email, None) for email in emails))
+        self.assertEqual(lost_smtp.send_message.call_count, 1)
+
+    def test_remaining_emails_fail_if_only_connection_is_lost(self):
+        smtp = FakeSMTP()
+        smtp.send_message = mock.Mock(
+            side_effect=[None, smtplib.SMTPServerDisconnected('lost')])
+        results = list(send_emails(['a', 'b', 'c'], lambda: smtp))
+        self.assertEqual(results[0], ('a', None))
+        self.assertEqual(sorted(email for email, _ in results[1:]),
+            ['b', 'c'])
+        for _, error in results[1:]:
+            self.assertIsInstance(error, smtplib.SMTPServerDisconnected)
+        self.assertEqual(smtp.send_message.call_count, 2)
+
+    def test_error_is_reported_for_all_emails_if_no_connection_opens(self):
+        error = smtplib.SMTPAuthenticationError(535, 'denied')
+        connect = mock.Mock(side_effect=error)
+        results = list(send_emails(['a', 'b'], connect, connections=2))
+        self.assertEqual(sorted(results), [('a', error), ('b', error)])
+
+    def test_failure_to_close_connection_is_ignored(self):
+        smtp = FakeSMTP()
+        smtp.quit.side_effect = smtplib.SMTPServerDisconnected()
+        results = list(send_emails(['a'], lambda: smtp))
+        self.assertEqual(results, [('a', None)])
+
+
+def create_email(to_addr):
+    email = MIMEText('body')
+    email['To'] = to_addr
+    return email
+
+
+class TestSMTPBackend(unittest.TestCase):
+    @mock.patch('doxygen_whiner.delivery.SMTP')
+    def test_user_is_logged_in_on_opened_connection(self, mock_smtp):
+        backend = SMTPBackend('smtp.gmail.com', 587, username='john',
+            password='secret')
+        smtp = backend()
+        mock_smtp.assert_called_once_with('smtp.gmail.com', 587)
+        smtp.login.assert_called_once_with('john', 'secret')
+
+    @mock.patch('doxygen_whiner.delivery.SMTP_SSL')
+    def test_ssl_is_used_if_requested(self, mock_smtp_ssl):
+        SMTPBackend('smtp.gmail.com', 465, use_ssl=True)()
+        mock_smtp_ssl.assert_called_once_with('smtp.gmail.com', 465)
+
+    @mock.patch('doxygen_whiner.delivery.SMTP')
+    def test_user_is_not_logged_in_without_username(self, mock_smtp):
+        smtp = SMTPBackend('localhost', 25)()
+        self.assertFalse(smtp.login.called)
+
+    @mock.patch('doxygen_whiner.delivery.SMTP')
+    def test_connection_is_closed_if_login_fails(self, mock_smtp):
+        smtp = mock_smtp.return_value
+        smtp.login.side_effect = smtplib.SMTPAuthenticationError(535, 'no')
+        backend = SMTPBackend('smtp.gmail.com', 587, username='john')
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            backend()
+        smtp.close.assert_called_once_with()
+
+
+class TestDryRunBackend(unittest.TestCase):
+    def test_emails_are_accepted(self):
+        results = list(send_emails([create_email('a@b.c')], DryRunBackend()))
+        self.assertIsNone(results[0][1])
+
+
+class TestMailboxBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def scenario_emails_are_stored_into_mailbox(self, format, open_mailbox):
+        path = os.path.join(self.temp_dir.name, 'sink')
+        emails = [create_email('{}@b.c'.format(i)) for i in range(10)]
+        results = list(send_emails(emails, MailboxBackend(path, format),
+            connections=3))
+        self.assertTrue(all(error is None for _, error in results))
+        self.assertEqual(sorted(email['To'] for email in open_mailbox(path)),
+            sorted(email['To'] for email in emails))
+
+    def test_emails_are_stored_into_mbox(self):
+        self.scenario_emails_are_stored_into_mailbox('mbox', mailbox.mbox)
+
+    def test_emails_are_stored_into_maildir(self):
+        self.scenario_emails_are_stored_into_mailbox('maildir',
+            mailbox.Maildir)
+
+    def test_unknown_format_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            MailboxBackend(self.temp_dir.name, 'mh2')
+
+
+class TestGetRetryDelay(unittest.TestCase):
+    def test_delay_doubles_with_each_attempt(self):
+        self.assertEqual([get_retry_delay(attempts, 60, 1000)
+            for attempts in range(1, 6)], [60, 120, 240, 480, 960])
+
+    def test_delay_is_limited(self):
+        self.assertEqual(get_retry_delay(20, 60, 1000), 1000)
+
+
+class TestSendSpooledEmails(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.database = Database(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def spool_emails(self, *to_addrs):
+        emails = []
+        for to_addr in to_addrs:
+            email = MIMEText('body')
+            email['To'] = to_addr
+            emails.append(email)
+        self.database.spool_emails(emails)
+        self.database.finish_run()
+
+    @mock.patch('time.time')
+    def test_sent_emails_are_removed_from_outbox(self, mock_time):
+        mock_time.return_value = 100
+        self.spool_emails('a@b.c', 'd@e.f')
+        smtp = FakeSMTP()
+        results = list(send_spooled_emails(self.database, lambda: smtp))
+        self.assertEqual([email['To'] for email, error in results],
+            ['a@b.c', 'd@e.f'])
+        self.assertEqual([email['To'] for email in smtp.sent_emails],
+            ['a@b.c', 'd@e.f'])
+        self.assertFalse(self.database.has_due_emails(2 ** 40))
+
+    @mock.patch('time.time')
+    def test_failed_emails_are_retried_with_backoff(self, mock_time):
+        mock_time.return_value = 100
+        self.spool_emails('a@b.c')
+        smtp = FakeSMTP(failing_emails=['a@b.c'])
+
+        list(send_spooled_emails(self.database, lambda: smtp,
+            retry_delay=10))
+        self.assertFalse(self.database.has_due_emails(109))
+        self.assertTrue(self.database.has_due_emails(110))
+
+        mock_time.return_value = 110
+        list(send_spooled_emails(self.database, lambda: smtp,
+            retry_delay=10))
+        self.assertFalse(self.database.has_due_emails(129))
+        self.assertTrue(self.database.has_due_emails(130))
+
+    @mock.patch('time.time')
+    def test_sending_is_given_up_after_max_attempts(self, mock_time):
+        mock_time.return_value = 100
+        self.spool_emails('a@b.c')
+        smtp = FakeSMTP(failing_emails=['a@b.c'])
+        list(send_spooled_emails(self.database, lambda: smtp,
+            max_attempts=1))
+        self.assertFalse(self.database.has_due_emails(2 ** 40))
+
+    def test_nothing_is_sent_when_outbox_is_empty(self):
+        connect = mock.Mock()
+        self.assertEqual(list(send_spooled_emails(self.database, connect)),
+            [])
+        self.assertFalse(connect.called)
@@ -7,8 +7,10 @@
 
 """Unit tests for the email module."""
 
+import gzip
 import unittest
 
+from doxygen_whiner.email import WARNINGS_ATTACHMENT_NAME
 from doxygen_whiner.email import create_email
 from doxygen_whiner.warning import Person
 from doxygen_whiner.warning import Warning
@@ -64,3 +66,54 @@ class TestCreateEmail(unittest.TestCase):
             self.from_addr, self.subject, reply_to_addr=reply_to_addr)
 
         self.assertEqual(email['Reply-To'], reply_to_addr)
+
+
+class TestCreateDigestEmail(unittest.TestCase):
+    def setUp(self):
+        self.culprit = Person('John Little', 'john.little@gmail.com')
+        self.warnings = [WarningWithCulprit(
+            Warning('/mnt/data/{}.c'.format('ab'[i % 2]), i, 'missing '
+                'argument'), self.culprit) for i in range(1, 6)]
+
+    def get_body_and_attachment(self, email):
+        body, attachment = email.get_payload()
+        return (body.get_payload(),
+            gzip.decompress(attachment.get_payload(decode=True)).decode())
+
+    def test_warnings_are_listed_in_body_within_limits(self):
+        email = create_email(self.culprit, self.warnings, 'doxygen@gmail.com',
+            'Warnings', max_warnings=5, max_size=10000)
+        self.assertFalse(email.is_multipart())
+        for warning in self.warnings:
+            self.assertIn(warning.original_data, email.get_payload())
+
+    def test_too_many_warnings_are_attached(self):
+        email = create_email(self.culprit, self.warnings, 'doxygen@gmail.com',
+            'Warnings', max_warnings=4)
+        self.assertTrue(email.is_multipart())
+        self.assertEqual(email['To'], self.culprit.email)
+        body, attachment = self.get_body_and_attachment(email)
+        self.assertIn('/mnt/data/a.c: 2\n', body)
+        self.assertIn('/mnt/data/b.c: 3\n', body)
+        self.assertNotIn(self.warnings[0].original_data, body)
+        self.assertEqual(attachment, '\n'.join(
+            warning.original_data for warning in self.warnings) + '\n')
+
+    def test_too_long_list_of_warnings_is_attached(self):
+        email = create_email(self.culprit, self.warnings, 'doxygen@gmail.com',
+            'Warnings', max_size=100)
+        body, attachment = self.get_body_and_attachment(email)
+        self.assertIn('reported 5 warnings', body)
+        self.assertEqual(attachment.count('\n'), 5)
+
+    def test_attachment_has_name(self):
+        email = create_email(self.culprit, self.warnings, 'doxygen@gmail.com',
+            'Warnings', max_warnings=1)
+        self.assertEqual(email.get_payload()[1].get_filename(),
+            WARNINGS_ATTACHMENT_NAME)
+
+    def test_warnings_may_be_given_by_iterator(self):
+        email = create_email(self.culprit, iter(self.warnings),
+            'doxygen@gmail.com', 'Warnings', max_warnings=2)
+        body, attachment = self.get_body_and_attachment(email)
+        self.assertEqual(attachment.count('\n'), 5)
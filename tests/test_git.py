@@ -7,7 +7,9 @@
 
 """Unit tests for the git module."""
 
+import io
 import os
+import tempfile
 import unittest
 import subprocess
 from unittest import mock
@@ -15,12 +17,189 @@ from unittest import mock
 from doxygen_whiner.warning import Warning
 from doxygen_whiner.warning import Person
 from doxygen_whiner.warning import WarningWithCulprit
+from doxygen_whiner.git import BlameIndex
 from doxygen_whiner.git import create_warning_with_culprit
+from doxygen_whiner.git import create_warnings_with_culprit
 from doxygen_whiner.git import GitError
+from doxygen_whiner.git import RepositoryResolver
+from doxygen_whiner.git import group_by_repository
+from doxygen_whiner.git import UNCOMMITTED_COMMIT
+from doxygen_whiner.git import UNCOMMITTED_EMAIL
+from doxygen_whiner.git import WHOLE_FILE_BLAME_MIN_LINES
 
 
-@mock.patch('os.chdir')
+def create_blame_porcelain_entry(commit, line, culprit=None):
+    entry = ['{} {} {} 1'.format(commit, line, line)]
+    if culprit is not None:
+        entry.extend([
+            'author {}'.format(culprit.name),
+            'author-mail <{}>'.format(culprit.email),
+            'author-time 1398073301',
+            'author-tz +0200',
+            'committer {}'.format(culprit.name),
+            'committer-mail <{}>'.format(culprit.email),
+            'committer-time 1398073301',
+            'committer-tz +0200',
+            'summary Added description.',
+            'boundary',
+            'filename error.c'])
+    entry.append('\tcontents of line {}'.format(line))
+    return entry
+
+
+def encode_porcelain(output_lines):
+    return io.BytesIO('\n'.join(output_lines).encode('utf-8'))
+
+
+def create_git_process(output_lines=(), *, returncode=0, error=b''):
+    process = mock.MagicMock()
+    process.stdout = encode_porcelain(output_lines)
+    process.stderr = io.BytesIO(error)
+    process.returncode = returncode
+    return process
+
+
+def create_git_run(head, changed_files):
+    # Returns a fake of subprocess.run() for git rev-parse and git diff.
+    # changed_files maps commits to files changed since them. Commits that
+    # are not in it do not exist.
+    def run(args, **kwargs):
+        if args[1] == 'rev-parse':
+            return subprocess.CompletedProcess(args, 0,
+                '{}\n'.format(head).encode('utf-8'), b'')
+        commit = args[4]
+        if commit not in changed_files:
+            return subprocess.CompletedProcess(args, 128, b'',
+                b'fatal: bad revision')
+        return subprocess.CompletedProcess(args, 0,
+            ''.join(file + '\0' for file in changed_files[commit]).encode(
+                'utf-8'), b'')
+    return run
+
+
+class TestBlameIndex(unittest.TestCase):
+    def setUp(self):
+        self.culprit1 = Person('John Little', 'john.little@gmail.com')
+        self.culprit2 = Person('Jane Book', 'jane.book@gmail.com')
+        self.commit1 = 'c1935c22bc9e78b5973cca27d4ad539f74cd1ee3'
+        self.commit2 = '8f2d5c2b0b1a0a8e1e3c3e2d8d2b1c0a9f8e7d6c'
+
+    def test_culprits_of_lines_are_correctly_parsed(self):
+        index = BlameIndex.from_porcelain(encode_porcelain(
+            create_blame_porcelain_entry(self.commit1, 1, self.culprit1) +
+            create_blame_porcelain_entry(self.commit2, 2, self.culprit2) +
+            create_blame_porcelain_entry(self.commit1, 3)))
+        self.assertEqual(index.culprit(1), self.culprit1)
+        self.assertEqual(index.culprit(2), self.culprit2)
+        self.assertEqual(index.culprit(3), self.culprit1)
+
+    def test_lines_of_same_commit_share_culprit(self):
+        index = BlameIndex.from_porcelain(encode_porcelain(
+            create_blame_porcelain_entry(self.commit1, 1, self.culprit1) +
+            create_blame_porcelain_entry(self.commit1, 2)))
+        self.assertIs(index.culprit(1), index.culprit(2))
+
+    def test_lines_which_were_not_blamed_are_not_in_index(self):
+        index = BlameIndex.from_porcelain(encode_porcelain(
+            create_blame_porcelain_entry(self.commit1, 5, self.culprit1)))
+        self.assertIn(5, index)
+        self.assertNotIn(4, index)
+        self.assertNotIn(6, index)
+        self.assertRaises(KeyError, index.culprit, 4)
+
+    def test_uncommitted_lines_are_recognized(self):
+        index = BlameIndex.from_porcelain(encode_porcelain(
+            create_blame_porcelain_entry(self.commit1, 1, self.culprit1) +
+            create_blame_porcelain_entry(UNCOMMITTED_COMMIT, 2,
+                Person('Not Committed Yet', UNCOMMITTED_EMAIL))))
+        self.assertTrue(index.is_committed(1))
+        self.assertFalse(index.is_committed(2))
+
+
+    def test_contents_of_lines_are_not_decoded(self):
+        output = encode_porcelain(
+            create_blame_porcelain_entry(self.commit1, 1, self.culprit1))
+        output = io.BytesIO(output.getvalue().replace(
+            b'contents of line 1', b'caf\xe9 \r 0 0 0 \xff'))
+        index = BlameIndex.from_porcelain(output)
+        self.assertEqual(index.culprit(1), self.culprit1)
+
+    def test_invalid_characters_in_culprit_are_replaced(self):
+        output = encode_porcelain(
+            create_blame_porcelain_entry(self.commit1, 1,
+                Person('Jos\xe9', 'jose@gmail.com')))
+        output = io.BytesIO(output.getvalue().replace(
+            'Jos\xe9'.encode('utf-8'), b'Jos\xe9'))
+        index = BlameIndex.from_porcelain(output)
+        self.assertEqual(index.culprit(1),
+            Person('Jos\ufffd', 'jose@gmail.com'))
+
 @mock.patch('subprocess.check_output')
+class TestRepositoryResolver(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repository = os.path.realpath(self.tmp_dir.name)
+        self.submodule = os.path.join(self.repository, 'lib', 'sub')
+        for dir in ['src/util', 'src/net', 'lib/sub/.git', 'lib/sub/src']:
+            os.makedirs(os.path.join(self.repository, dir))
+        os.makedirs(os.path.join(self.repository, '.git'))
+        self.resolver = RepositoryResolver()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, *components):
+        return os.path.join(self.repository, *components)
+
+    def test_toplevel_is_returned(self, mock_check_output):
+        mock_check_output.return_value = (self.repository + '\n').encode()
+        self.assertEqual(self.resolver.resolve(self.path('src', 'util')),
+            self.repository)
+        mock_check_output.assert_called_once_with(
+            ['git', 'rev-parse', '--show-toplevel'],
+            cwd=self.path('src', 'util'), stderr=subprocess.STDOUT)
+
+    def test_git_is_run_once_per_directory(self, mock_check_output):
+        mock_check_output.return_value = (self.repository + '\n').encode()
+        self.resolver.resolve(self.path('src', 'util'))
+        self.resolver.resolve(self.path('src', 'util'))
+        self.assertEqual(mock_check_output.call_count, 1)
+
+    def test_resolved_parent_is_used_for_subdirectories(self, mock_check_output):
+        mock_check_output.return_value = (self.repository + '\n').encode()
+        self.resolver.resolve(self.path('src', 'util'))
+        self.assertEqual(self.resolver.resolve(self.path('src', 'net')),
+            self.repository)
+        self.assertEqual(mock_check_output.call_count, 1)
+
+    def test_submodules_are_resolved_separately(self, mock_check_output):
+        mock_check_output.side_effect = [
+            (self.repository + '\n').encode(),
+            (self.submodule + '\n').encode()]
+        self.resolver.resolve(self.path('src'))
+        self.assertEqual(self.resolver.resolve(self.path('lib', 'sub', 'src')),
+            self.submodule)
+        self.assertEqual(mock_check_output.call_count, 2)
+
+    def test_dir_not_in_repository_raises_git_error(self, mock_check_output):
+        mock_check_output.side_effect = subprocess.CalledProcessError(
+            128, 'git', b'fatal: not a git repository')
+        with self.assertRaises(GitError) as e:
+            self.resolver.resolve(self.path('src'))
+        self.assertEqual(str(e.exception), 'fatal: not a git repository')
+
+    def test_group_by_repository(self, mock_check_output):
+        mock_check_output.side_effect = [
+            (self.repository + '\n').encode(),
+            (self.submodule + '\n').encode()]
+        files = [self.path('src', 'a.c'), self.path('lib', 'sub', 'b.c'),
+                 self.path('src', 'c.c')]
+        self.assertEqual(group_by_repository(files, self.resolver), {
+            self.repository: [files[0], files[2]],
+            self.submodule: [files[1]]})
+
+
+@mock.patch('subprocess.Popen')
 class TestCreateWarningWithCulprit(unittest.TestCase):
     def setUp(self):
         file = '/mnt/data/error.c'
@@ -32,58 +211,307 @@ class TestCreateWarningWithCulprit(unittest.TestCase):
         self.culprit = Person(name, email)
         self.warn_with_culprit = WarningWithCulprit(self.warn, self.culprit)
 
-    def test_create_from_valid_data(self, mock_check_output, mock_chdir):
-        mock_check_output.return_value = '\n'.join([
-            'c1935c22bc9e78b5973cca27d4ad539f74cd1ee3 {0} {0} 1',
-            'author {1}',
-            'author-mail <{2}>',
-            'author-time 1398073301',
-            'author-tz +0200',
-            'committer {1}',
-            'committer-mail <{2}>',
-            'committer-time 1398073301',
-            'committer-tz +0200',
-            'summary Added description.',
-            'boundary',
-            'filename {3}',
-            '        \\class']
-        ).format(
-            self.warn.line,
-            self.warn_with_culprit.culprit.name,
-            self.warn_with_culprit.culprit.email,
-            self.warn.file
-        ).encode('utf-8')
+    def test_create_from_valid_data(self, mock_popen):
+        mock_popen.return_value = create_git_process(
+            create_blame_porcelain_entry(
+                'c1935c22bc9e78b5973cca27d4ad539f74cd1ee3',
+                self.warn.line, self.culprit))
 
         self.assertEqual(create_warning_with_culprit(self.warn),
             self.warn_with_culprit)
 
-    def test_file_dir_does_not_exist(self, mock_check_output, mock_chdir):
-        mock_chdir.side_effect = [FileNotFoundError, None]
+    def test_file_dir_does_not_exist(self, mock_popen):
+        mock_popen.side_effect = FileNotFoundError
         self.assertRaises(GitError,
             create_warning_with_culprit, self.warn)
 
-    def test_git_command_does_not_exist(self, mock_check_output, mock_chdir):
-        mock_check_output.side_effect = FileNotFoundError
+    def test_git_command_does_not_exist(self, mock_popen):
+        mock_popen.side_effect = FileNotFoundError
         self.assertRaises(GitError,
             create_warning_with_culprit, self.warn)
 
-    def test_file_does_not_exist(self, mock_check_output, mock_chdir):
-        mock_check_output.side_effect = subprocess.CalledProcessError(128, 'git', b'error')
+    def test_file_does_not_exist(self, mock_popen):
+        mock_popen.return_value = create_git_process(
+            returncode=128, error=b'error')
         with self.assertRaises(GitError) as e:
             create_warning_with_culprit(self.warn)
         self.assertEqual(str(e.exception), 'error')
 
-    def test_line_in_file_does_not_exist(self, mock_check_output, mock_chdir):
-        mock_check_output.side_effect = subprocess.CalledProcessError(128, 'git', b'error')
+    def test_line_in_file_does_not_exist(self, mock_popen):
+        mock_popen.return_value = create_git_process(
+            returncode=128, error=b'error')
         with self.assertRaises(GitError) as e:
             create_warning_with_culprit(self.warn)
         self.assertEqual(str(e.exception), 'error')
 
-    def test_upon_raising_exception_chdir_to_original_cwd_is_called(
-            self, mock_check_output, mock_chdir):
-        mock_check_output.side_effect = subprocess.CalledProcessError(128, 'git', b'error')
-        original_cwd = os.getcwd()
-        with self.assertRaises(GitError) as e:
+    @mock.patch('os.chdir')
+    def test_git_is_run_in_file_dir_without_changing_cwd(
+            self, mock_chdir, mock_popen):
+        mock_popen.return_value = create_git_process(
+            returncode=128, error=b'error')
+        with self.assertRaises(GitError):
             create_warning_with_culprit(self.warn)
+        self.assertEqual(mock_popen.call_args[1]['cwd'], self.warn.dir)
+        self.assertFalse(mock_chdir.called)
+
+
+@mock.patch('subprocess.check_output')
+@mock.patch('subprocess.Popen')
+class TestCreateWarningsWithCulprit(unittest.TestCase):
+    def setUp(self):
+        self.culprit1 = Person('John Little', 'john.little@gmail.com')
+        self.culprit2 = Person('Jane Book', 'jane.book@gmail.com')
+        self.commit1 = 'c1935c22bc9e78b5973cca27d4ad539f74cd1ee3'
+        self.commit2 = '8f2d5c2b0b1a0a8e1e3c3e2d8d2b1c0a9f8e7d6c'
+        self.warn1 = Warning('/mnt/data/error.c', 45, 'missing argument')
+        self.warn2 = Warning('/mnt/data/error.c', 46, 'missing parameter')
+        self.warn3 = Warning('/mnt/data/error.c', 80, 'missing argument')
+        # Every directory is a repository of its own.
+        self.resolver = mock.Mock()
+        self.resolver.resolve.side_effect = lambda dir: dir
+
+    def test_no_warnings_generate_nothing(self, mock_popen, mock_check_output):
+        self.assertEqual(list(create_warnings_with_culprit([],
+            resolver=self.resolver)), [])
+        self.assertFalse(mock_popen.called)
+
+    def test_git_blame_is_run_once_per_file(self, mock_popen, mock_check_output):
+        mock_popen.return_value = create_git_process(
+            create_blame_porcelain_entry(self.commit1, 45, self.culprit1) +
+            create_blame_porcelain_entry(self.commit2, 46, self.culprit2) +
+            create_blame_porcelain_entry(self.commit1, 80))
+
+        warnings_with_culprit = list(create_warnings_with_culprit(
+            [self.warn3, self.warn1, self.warn2], resolver=self.resolver))
+
+        self.assertEqual(warnings_with_culprit, [
+            WarningWithCulprit(self.warn3, self.culprit1),
+            WarningWithCulprit(self.warn1, self.culprit1),
+            WarningWithCulprit(self.warn2, self.culprit2)])
+        mock_popen.assert_called_once_with(
+            ['git', 'blame', 'error.c', '-L', '45,46', '-L', '80,80',
+             '--porcelain'], cwd='/mnt/data',
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def test_whole_file_is_blamed_if_it_has_many_warnings(
+            self, mock_popen, mock_check_output):
+        lines = range(1, WHOLE_FILE_BLAME_MIN_LINES + 1)
+        output = create_blame_porcelain_entry(self.commit1, 1, self.culprit1)
+        for line in lines[1:]:
+            output += create_blame_porcelain_entry(self.commit1, line)
+        mock_popen.return_value = create_git_process(output)
+        warnings = [Warning('/mnt/data/error.c', line, 'missing argument')
+            for line in lines]
+
+        warnings_with_culprit = list(create_warnings_with_culprit(warnings,
+            resolver=self.resolver))
+
+        self.assertEqual(warnings_with_culprit,
+            [WarningWithCulprit(w, self.culprit1) for w in warnings])
+        self.assertEqual(mock_popen.call_args[0][0],
+            ['git', 'blame', 'error.c', '--porcelain'])
+
+    def test_line_missing_in_whole_file_blame_raises_git_error(
+            self, mock_popen, mock_check_output):
+        output = create_blame_porcelain_entry(self.commit1, 1, self.culprit1)
+        mock_popen.return_value = create_git_process(output)
+        warnings = [Warning('/mnt/data/error.c', line, 'missing argument')
+            for line in range(1, WHOLE_FILE_BLAME_MIN_LINES + 1)]
+
+        with self.assertRaises(GitError):
+            list(create_warnings_with_culprit(warnings,
+            resolver=self.resolver))
+
+    def test_files_are_blamed_in_parallel_in_order(
+            self, mock_popen, mock_check_output):
+        def popen(args, *, cwd, stdout, stderr):
+            lines = [int(arg.split(',')[0]) for arg in args[4:-1:2]]
+            commit = self.commit1 if cwd == '/mnt/data' else self.commit2
+            culprit = self.culprit1 if cwd == '/mnt/data' else self.culprit2
+            output = create_blame_porcelain_entry(commit, lines[0], culprit)
+            for line in lines[1:]:
+                output += create_blame_porcelain_entry(commit, line)
+            return create_git_process(output)
+        mock_popen.side_effect = popen
+        warn4 = Warning('/mnt/other/quick.c', 12, 'missing parameter')
+
+        warnings_with_culprit = list(create_warnings_with_culprit(
+            [self.warn1, warn4, self.warn3], jobs=4, resolver=self.resolver))
+
+        self.assertEqual(warnings_with_culprit, [
+            WarningWithCulprit(self.warn1, self.culprit1),
+            WarningWithCulprit(warn4, self.culprit2),
+            WarningWithCulprit(self.warn3, self.culprit1)])
+
+    def test_warnings_with_same_culprit_share_person(
+            self, mock_popen, mock_check_output):
+        mock_popen.side_effect = lambda args, **kwargs: create_git_process(
+            create_blame_porcelain_entry(self.commit1, 45,
+                Person('John Little', 'john.little@gmail.com')))
+        warn4 = Warning('/mnt/other/quick.c', 45, 'missing parameter')
+
+        warn_with_culprit1, warn_with_culprit4 = create_warnings_with_culprit(
+            [self.warn1, warn4], resolver=self.resolver)
+
+        self.assertIs(warn_with_culprit1.culprit, warn_with_culprit4.culprit)
+
+    def test_git_error_is_propagated(self, mock_popen, mock_check_output):
+        mock_popen.return_value = create_git_process(
+            returncode=128, error=b'error')
+        with self.assertRaises(GitError) as e:
+            list(create_warnings_with_culprit([self.warn1],
+                resolver=self.resolver))
         self.assertEqual(str(e.exception), 'error')
-        self.assertEqual(mock_chdir.mock_calls[-1], mock.call(original_cwd))
+
+    def test_cached_culprits_are_not_blamed_again(
+            self, mock_popen, mock_check_output):
+        mock_check_output.return_value = b'blob1\n'
+        mock_popen.return_value = create_git_process(
+            create_blame_porcelain_entry(self.commit2, 46, self.culprit2) +
+            create_blame_porcelain_entry(UNCOMMITTED_COMMIT, 80,
+                Person('Not Committed Yet', UNCOMMITTED_EMAIL)))
+        cache = mock.Mock()
+        cache.get_cached_culprits.return_value = {
+            ('/mnt/data/error.c', 45): self.culprit1}
+
+        warnings_with_culprit = list(create_warnings_with_culprit(
+            [self.warn1, self.warn2, self.warn3], cache=cache,
+            resolver=self.resolver))
+
+        self.assertEqual(warnings_with_culprit[:2], [
+            WarningWithCulprit(self.warn1, self.culprit1),
+            WarningWithCulprit(self.warn2, self.culprit2)])
+        self.assertEqual(mock_popen.call_args[0][0],
+            ['git', 'blame', 'error.c', '-L', '46,46', '-L', '80,80',
+             '--porcelain'])
+        cache.get_cached_culprits.assert_called_once_with(
+            {'/mnt/data/error.c': 'blob1'})
+        # Uncommitted lines are not cached.
+        cache.cache_culprits.assert_called_once_with(
+            [('/mnt/data/error.c', 'blob1', 46, self.culprit2)])
+        cache.prune_cached_culprits.assert_called_once_with(
+            {'/mnt/data/error.c': 'blob1'})
+
+
+@mock.patch('subprocess.run')
+@mock.patch('subprocess.check_output')
+@mock.patch('subprocess.Popen')
+class TestCreateWarningsWithCulpritIncrementally(unittest.TestCase):
+    def setUp(self):
+        self.culprit1 = Person('John Little', 'john.little@gmail.com')
+        self.culprit2 = Person('Jane Book', 'jane.book@gmail.com')
+        self.commit1 = 'c1935c22bc9e78b5973cca27d4ad539f74cd1ee3'
+        self.warn1 = Warning('/mnt/data/error.c', 45, 'missing argument')
+        self.warn2 = Warning('/mnt/data/error.c', 46, 'missing parameter')
+        # Every directory is a repository of its own.
+        self.resolver = mock.Mock()
+        self.resolver.resolve.side_effect = lambda dir: dir
+        self.cache = mock.Mock()
+        self.cache.get_last_repository_state.return_value = (
+            3, 'head1', set())
+        self.cache.get_previous_culprits.return_value = {
+            ('/mnt/data/error.c', 45): self.culprit1,
+            ('/mnt/data/error.c', 46): self.culprit2}
+        self.cache.get_cached_culprits.return_value = {}
+
+    def create_warnings_with_culprit(self):
+        return list(create_warnings_with_culprit([self.warn1, self.warn2],
+            cache=self.cache, resolver=self.resolver, incremental=True))
+
+    def scenario_file_is_blamed(self, mock_popen, mock_check_output):
+        mock_check_output.return_value = b'blob1\n'
+        mock_popen.return_value = create_git_process(
+            create_blame_porcelain_entry(self.commit1, 45, self.culprit2) +
+            create_blame_porcelain_entry(self.commit1, 46))
+
+        warnings_with_culprit = self.create_warnings_with_culprit()
+
+        self.assertEqual(warnings_with_culprit, [
+            WarningWithCulprit(self.warn1, self.culprit2),
+            WarningWithCulprit(self.warn2, self.culprit2)])
+        self.cache.get_previous_culprits.assert_called_once_with(3, [],
+            excluded_email=UNCOMMITTED_EMAIL)
+
+    def test_culprits_in_unchanged_files_are_taken_from_last_run(
+            self, mock_popen, mock_check_output, mock_run):
+        mock_run.side_effect = create_git_run('head2',
+            {'head1': [], 'head2': []})
+
+        warnings_with_culprit = self.create_warnings_with_culprit()
+
+        self.assertEqual(warnings_with_culprit, [
+            WarningWithCulprit(self.warn1, self.culprit1),
+            WarningWithCulprit(self.warn2, self.culprit2)])
+        self.cache.get_last_repository_state.assert_called_once_with(
+            '/mnt/data')
+        self.cache.get_previous_culprits.assert_called_once_with(3,
+            ['/mnt/data/error.c'], excluded_email=UNCOMMITTED_EMAIL)
+        # Neither blame nor hashing is needed.
+        self.assertFalse(mock_popen.called)
+        self.assertFalse(mock_check_output.called)
+
+    def test_state_of_repository_is_stored(
+            self, mock_popen, mock_check_output, mock_run):
+        mock_run.side_effect = create_git_run('head2',
+            {'head1': [], 'head2': ['other.c']})
+
+        self.create_warnings_with_culprit()
+
+        self.cache.store_repository_state.assert_called_once_with(
+            '/mnt/data', 'head2', {'other.c'})
+
+    def test_changed_file_is_blamed(
+            self, mock_popen, mock_check_output, mock_run):
+        mock_run.side_effect = create_git_run('head2',
+            {'head1': ['error.c'], 'head2': []})
+        self.scenario_file_is_blamed(mock_popen, mock_check_output)
+
+    def test_file_dirty_during_last_run_is_blamed(
+            self, mock_popen, mock_check_output, mock_run):
+        mock_run.side_effect = create_git_run('head2',
+            {'head1': [], 'head2': []})
+        self.cache.get_last_repository_state.return_value = (
+            3, 'head1', {'error.c'})
+        self.scenario_file_is_blamed(mock_popen, mock_check_output)
+
+    def test_all_files_are_blamed_if_last_head_does_not_exist(
+            self, mock_popen, mock_check_output, mock_run):
+        mock_run.side_effect = create_git_run('head2', {'head2': []})
+        mock_check_output.return_value = b'blob1\n'
+        mock_popen.return_value = create_git_process(
+            create_blame_porcelain_entry(self.commit1, 45, self.culprit2) +
+            create_blame_porcelain_entry(self.commit1, 46))
+
+        self.create_warnings_with_culprit()
+
+        self.assertTrue(mock_popen.called)
+        self.assertFalse(self.cache.get_previous_culprits.called)
+
+    def test_all_files_are_blamed_without_last_state(
+            self, mock_popen, mock_check_output, mock_run):
+        mock_run.side_effect = create_git_run('head2', {'head2': []})
+        self.cache.get_last_repository_state.return_value = None
+        mock_check_output.return_value = b'blob1\n'
+        mock_popen.return_value = create_git_process(
+            create_blame_porcelain_entry(self.commit1, 45, self.culprit2) +
+            create_blame_porcelain_entry(self.commit1, 46))
+
+        self.create_warnings_with_culprit()
+
+        self.assertTrue(mock_popen.called)
+        self.cache.store_repository_state.assert_called_once_with(
+            '/mnt/data', 'head2', set())
+
+    def test_state_is_not_used_without_incremental(
+            self, mock_popen, mock_check_output, mock_run):
+        mock_check_output.return_value = b'blob1\n'
+        mock_popen.return_value = create_git_process(
+            create_blame_porcelain_entry(self.commit1, 45, self.culprit2) +
+            create_blame_porcelain_entry(self.commit1, 46))
+
+        list(create_warnings_with_culprit([self.warn1, self.warn2],
+            cache=self.cache, resolver=self.resolver))
+
+        self.assertFalse(mock_run.called)
+        self.assertFalse(self.cache.get_last_repository_state.called)
+        self.assertFalse(self.cache.store_repository_state.called)
@@ -7,6 +7,8 @@
 
 """Unit tests for the io module."""
 
+import os
+import tempfile
 import unittest
 from io import StringIO
 
@@ -44,3 +46,104 @@ class TestIOReadStdin(unittest.TestCase):
     def test_data_on_stdin(self):
         data = 'blabla\nblababla\nbla'
         self.scenario_stdin_is_read_correctly(data)
+
+
+class TestIOOpenInput(unittest.TestCase):
+    def test_file_is_opened_if_given(self):
+        data = 'blabla\nblababla\nbla'
+        with TemporaryFile(data) as tf:
+            with io.open_input(tf.name) as f:
+                self.assertEqual(f.read(), data)
+            self.assertTrue(f.closed)
+
+    def test_stdin_is_used_if_no_file_is_given(self):
+        stream = StringIO('blabla')
+        with RedirectStdin(stream):
+            with io.open_input() as f:
+                self.assertIs(f, stream)
+        self.assertFalse(stream.closed)
+
+
+class TestLogTail(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'doxygen.log')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, data, mode='w'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def read(self, position=None, is_continuation=None):
+        tail = io.LogTail(self.path, position,
+            is_continuation=is_continuation)
+        return tail, list(tail.lines())
+
+    def test_whole_file_is_read_without_position(self):
+        self.write('a\nb\n')
+        tail, lines = self.read()
+        self.assertEqual(lines, ['a\n', 'b\n'])
+        self.assertFalse(tail.restarted)
+
+    def test_only_appended_lines_are_read(self):
+        self.write('a\nb\n')
+        tail, _ = self.read()
+        self.write('c\n', 'a')
+        tail, lines = self.read(tail.position)
+        self.assertEqual(lines, ['c\n'])
+        self.assertFalse(tail.restarted)
+
+    def test_nothing_is_read_if_file_has_not_grown(self):
+        self.write('a\n')
+        tail, _ = self.read()
+        tail, lines = self.read(tail.position)
+        self.assertEqual(lines, [])
+        self.assertFalse(tail.restarted)
+
+    def test_incomplete_line_is_read_next_time(self):
+        self.write('a\nb')
+        tail, lines = self.read()
+        self.assertEqual(lines, ['a\n'])
+        self.write('c\n', 'a')
+        tail, lines = self.read(tail.position)
+        self.assertEqual(lines, ['bc\n'])
+
+    def test_truncated_file_is_read_from_beginning(self):
+        self.write('a\nb\n')
+        tail, _ = self.read()
+        self.write('c\n')
+        tail, lines = self.read(tail.position)
+        self.assertEqual(lines, ['c\n'])
+        self.assertTrue(tail.restarted)
+
+    def test_rewritten_file_of_same_size_is_read_from_beginning(self):
+        self.write('a\nb\n')
+        tail, _ = self.read()
+        self.write('c\nd\ne\n')
+        tail, lines = self.read(tail.position)
+        self.assertEqual(lines, ['c\n', 'd\n', 'e\n'])
+        self.assertTrue(tail.restarted)
+
+    def test_replaced_file_is_read_from_beginning(self):
+        self.write('a\n')
+        tail, _ = self.read()
+        os.rename(self.path, self.path + '.1')
+        self.write('a\nb\n')
+        tail, lines = self.read(tail.position)
+        self.assertEqual(lines, ['a\n', 'b\n'])
+        self.assertTrue(tail.restarted)
+
+    def test_last_line_is_held_back_until_line_not_continuing_it(self):
+        is_continuation = lambda line: line.startswith(' ')
+        self.write('a\n b\nc\n d\n')
+        tail, lines = self.read(is_continuation=is_continuation)
+        self.assertEqual(lines, ['a\n', ' b\n'])
+        self.write(' e\n', 'a')
+        tail, lines = self.read(tail.position, is_continuation)
+        self.assertEqual(lines, [])
+        self.write('f\n', 'a')
+        tail, lines = self.read(tail.position, is_continuation)
+        self.assertEqual(lines, ['c\n', ' d\n', ' e\n'])
+        self.assertFalse(tail.restarted)
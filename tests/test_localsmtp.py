@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""Unit tests for the localsmtp module."""
+
+import smtplib
+import unittest
+from email.mime.text import MIMEText
+
+from doxygen_whiner.delivery import SMTPBackend
+from doxygen_whiner.delivery import send_emails
+from doxygen_whiner.localsmtp import LocalSMTPServer
+
+
+class TestLocalSMTPServer(unittest.TestCase):
+    def setUp(self):
+        self.received_emails = []
+        self.server = LocalSMTPServer(self.received_emails.append)
+        self.server.start()
+        self.addCleanup(self.server.close)
+
+    def create_email(self, to_addr, body='body'):
+        email = MIMEText(body)
+        email['From'] = 'doxygen@gmail.com'
+        email['To'] = to_addr
+        email['Subject'] = 'Warnings'
+        return email
+
+    def test_sent_email_is_received(self):
+        with smtplib.SMTP(*self.server.address) as smtp:
+            smtp.send_message(self.create_email('john.little@gmail.com'))
+        self.assertEqual(len(self.received_emails), 1)
+        self.assertEqual(self.received_emails[0]['To'],
+            'john.little@gmail.com')
+
+    def test_any_login_is_accepted(self):
+        with smtplib.SMTP(*self.server.address) as smtp:
+            smtp.login('john', 'secret')
+
+    def test_lines_starting_with_dot_are_received_unchanged(self):
+        body = 'first\n.second\n..third\n'
+        with smtplib.SMTP(*self.server.address) as smtp:
+            smtp.send_message(self.create_email('a@b.c', body))
+        self.assertEqual(self.received_emails[0].get_payload(), body)
+
+    def test_emails_are_received_over_multiple_connections(self):
+        emails = [self.create_email('{}@b.c'.format(i)) for i in range(20)]
+        backend = SMTPBackend(*self.server.address, username='john',
+            password='secret')
+        results = list(send_emails(emails, backend, connections=4))
+        self.assertTrue(all(error is None for _, error in results))
+        self.assertEqual(sorted(email['To'] for email in self.received_emails),
+            sorted(email['To'] for email in emails))
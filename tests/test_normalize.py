@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf8
+
+"""Unit tests for the normalize module."""
+
+import configparser
+import unittest
+
+from doxygen_whiner.normalize import DEFAULT_RULES
+from doxygen_whiner.normalize import Normalizer
+from doxygen_whiner.normalize import normalize_text
+from doxygen_whiner.normalize import parse_rules
+from doxygen_whiner.normalize import set_rules
+
+
+class TestNormalizeText(unittest.TestCase):
+    def test_numbers_are_replaced(self):
+        self.assertEqual(normalize_text('see lines 10 and 125'),
+            'see lines XXX and XXX')
+
+    def test_numbers_in_identifiers_are_kept(self):
+        self.assertEqual(normalize_text('parameter dog43'),
+            'parameter dog43')
+
+    def test_text_without_numbers_is_unchanged(self):
+        self.assertEqual(normalize_text(r'missing argument after \class'),
+            r'missing argument after \class')
+
+    def test_set_rules_changes_used_rules(self):
+        self.addCleanup(set_rules, DEFAULT_RULES)
+        set_rules([('paths', r'/tmp/\w+', '/tmp/XXX')])
+        self.assertEqual(normalize_text('/tmp/abc12 line 3'),
+            '/tmp/XXX line 3')
+
+
+class TestNormalizer(unittest.TestCase):
+    def test_all_rules_are_applied(self):
+        normalizer = Normalizer([
+            ('addresses', r'\b0x[0-9a-fA-F]+\b', '0xXXX'),
+            ('templates', r'<[^<>]*>', '<...>'),
+            ('numbers', r'\b\d+\b', 'XXX'),
+        ])
+        self.assertEqual(
+            normalizer.normalize('Foo<int, 3> at 0x7ffd12 line 25'),
+            'Foo<...> at 0xXXX line XXX')
+
+    def test_first_rule_wins_when_rules_match_at_same_position(self):
+        normalizer = Normalizer([
+            ('first', r'ab', '1'),
+            ('second', r'abc', '2'),
+        ])
+        self.assertEqual(normalizer.normalize('abc'), '1c')
+
+    def test_groups_in_patterns_do_not_affect_replacement(self):
+        normalizer = Normalizer([
+            ('first', r'(?P<x>a)(b)', '1'),
+            ('second', r'(c)', '2'),
+        ])
+        self.assertEqual(normalizer.normalize('abc'), '12')
+
+    def test_text_is_unchanged_when_there_are_no_rules(self):
+        self.assertEqual(Normalizer([]).normalize('line 25'), 'line 25')
+
+    def test_invalid_pattern_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            Normalizer([('broken', r'(', 'X')])
+
+    def test_pattern_with_global_flag_raises_value_error(self):
+        with self.assertRaisesRegex(ValueError, 'addresses'):
+            Normalizer([('numbers', r'\b\d+\b', 'XXX'),
+                ('addresses', r'(?i)0x[0-9a-f]+', '0xXXX')])
+
+    def test_pattern_with_scoped_flag_is_applied(self):
+        normalizer = Normalizer([('addresses', r'(?i:0x[0-9a-f]+)', '0xXXX')])
+        self.assertEqual(normalizer.normalize('at 0xDEADbeef'), 'at 0xXXX')
+
+    def test_patterns_with_same_named_group_raise_value_error(self):
+        with self.assertRaisesRegex(ValueError, 'second'):
+            Normalizer([('first', r'(?P<x>a)', 'A'),
+                ('second', r'(?P<x>b)', 'B')])
+
+    def test_pattern_with_reserved_group_name_raises_value_error(self):
+        with self.assertRaisesRegex(ValueError, 'second'):
+            Normalizer([('first', r'a', 'A'),
+                ('second', r'(?P<_rule0>b)', 'B')])
+
+    def test_normalized_texts_are_cached(self):
+        normalizer = Normalizer(DEFAULT_RULES)
+        normalizer.normalize('see line 10')
+        normalizer.normalize('see line 10')
+        self.assertEqual(normalizer.normalize.cache_info().hits, 1)
+
+
+class TestParseRules(unittest.TestCase):
+    def parse_section(self, text):
+        config = configparser.ConfigParser()
+        config.read_string('[normalize]\n' + text)
+        return parse_rules(config['normalize'])
+
+    def test_rules_are_parsed_in_order(self):
+        rules = self.parse_section(
+            'addresses = 0x[0-9a-f]+ -> 0xXXX\n'
+            'numbers = \\b\\d+\\b -> XXX\n')
+        self.assertEqual(rules, [
+            ('addresses', r'0x[0-9a-f]+', '0xXXX'),
+            ('numbers', r'\b\d+\b', 'XXX'),
+        ])
+
+    def test_percent_sign_is_not_interpolated(self):
+        rules = self.parse_section('percents = \\d+% -> XXX%\n')
+        self.assertEqual(rules, [('percents', r'\d+%', 'XXX%')])
+
+    def test_replacement_may_be_empty(self):
+        rules = self.parse_section('spaces = \\s+$ ->\n')
+        self.assertEqual(rules, [('spaces', r'\s+$', '')])
+
+    def test_rule_without_arrow_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.parse_section('numbers = \\d+\n')
@@ -9,30 +9,37 @@
 
 import unittest
 
-from doxygen_whiner.utils import TypeCheckedAttribute
+from doxygen_whiner.utils import batched
+from doxygen_whiner.utils import check_type
+from doxygen_whiner.utils import enable_type_checking
+from doxygen_whiner.utils import type_checking_enabled
 
 
-class WithAttributes:
-    str_attr = TypeCheckedAttribute('str_attr', str)
-    int_attr = TypeCheckedAttribute('int_attr', int)
+class TestCheckType(unittest.TestCase):
+    def tearDown(self):
+        enable_type_checking(False)
 
-    def __init__(self, str_attr, int_attr):
-        self.str_attr = str_attr
-        self.int_attr = int_attr
+    def test_type_checking_is_disabled_by_default(self):
+        self.assertFalse(type_checking_enabled())
+        check_type(15, str)
 
+    def test_invalid_type_raises_exception_if_enabled(self):
+        enable_type_checking()
+        self.assertTrue(type_checking_enabled())
+        self.assertRaises(TypeError, check_type, 15, str)
 
-class TestTypeCheckedAttribute(unittest.TestCase):
-    def test_types_are_correct(self):
-        attrs = WithAttributes('string', 15)
-        self.assertEqual(attrs.str_attr, 'string')
-        self.assertEqual(attrs.int_attr, 15)
+    def test_valid_type_passes_if_enabled(self):
+        enable_type_checking()
+        check_type('string', str)
 
-    def test_str_type_is_incorrect(self):
-        self.assertRaises(TypeError, WithAttributes, 15, 15)
 
-    def test_int_type_is_incorrect(self):
-        self.assertRaises(TypeError, WithAttributes, 'string', 15.5)
+class TestBatched(unittest.TestCase):
+    def test_empty_iterable_generates_nothing(self):
+        self.assertEqual(list(batched([], 2)), [])
 
-    def test_add_attribute_to_descriptor(self):
-        WithAttributes.str_attr.new = 5
-        self.assertEqual(WithAttributes.str_attr.new, 5)
+    def test_last_batch_may_be_smaller(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_works_with_iterators(self):
+        self.assertEqual(list(batched(iter('abcd'), 2)),
+            [['a', 'b'], ['c', 'd']])
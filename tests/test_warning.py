@@ -8,10 +8,19 @@
 """Unit tests for the warning module."""
 
 import unittest
+from io import StringIO
+from unittest import mock
 
+from doxygen_whiner.utils import enable_type_checking
+from .utils import TemporaryFile
+
+from doxygen_whiner.warning import CulpritGrouper
 from doxygen_whiner.warning import Person
+from doxygen_whiner.warning import PersonRegistry
 from doxygen_whiner.warning import Warning
 from doxygen_whiner.warning import WarningWithCulprit
+from doxygen_whiner.warning import iter_warnings
+from doxygen_whiner.warning import iter_warnings_mmap
 from doxygen_whiner.warning import parse_warnings
 from doxygen_whiner.warning import group_by_culprit
 
@@ -26,11 +35,21 @@ class TestWarning(unittest.TestCase):
         self.assertEqual(w.line, line)
         self.assertEqual(w.text, text)
 
-    def test_types_of_warning_attributes_are_checked(self):
+    def test_types_of_warning_attributes_are_checked_if_enabled(self):
+        enable_type_checking()
+        self.addCleanup(enable_type_checking, False)
         self.assertRaises(TypeError, Warning, 52, 45, '')
         self.assertRaises(TypeError, Warning, '', 45.5, '')
         self.assertRaises(TypeError, Warning, '', 45, 45)
 
+    def test_types_of_warning_attributes_are_not_checked_by_default(self):
+        warn = Warning('/src/check.h', '25', 'missing argument')
+        self.assertEqual(warn.line, '25')
+
+    def test_warning_has_no_instance_dict(self):
+        warn = Warning('/src/check.h', 25, 'missing argument')
+        self.assertFalse(hasattr(warn, '__dict__'))
+
     def test_two_warnings_with_same_data_are_equivalent(self):
         warn1 = Warning('/src/check.h', 25, 'missing argument')
         warn2 = Warning('/src/check.h', 25, 'missing argument')
@@ -74,6 +93,20 @@ class TestWarning(unittest.TestCase):
         self.assertEqual(warn.original_data,
             r'/src/check.h:25: warning: missing argument after \class')
 
+    @mock.patch('doxygen_whiner.warning.normalize_text')
+    def test_text_to_cmp_is_normalized_only_once(self, mock_normalize_text):
+        mock_normalize_text.return_value = 'see line XXX'
+        warn = Warning('/src/check.h', 25, 'see line 10')
+        self.assertEqual(warn.text_to_cmp, 'see line XXX')
+        self.assertEqual(warn.text_to_cmp, 'see line XXX')
+        mock_normalize_text.assert_called_once_with('see line 10')
+
+    def test_text_to_cmp_reflects_changed_text(self):
+        warn = Warning('/src/check.h', 25, 'see line 10')
+        self.assertEqual(warn.text_to_cmp, 'see line XXX')
+        warn.text = 'missing argument'
+        self.assertEqual(warn.text_to_cmp, 'missing argument')
+
 
 class TestPerson(unittest.TestCase):
     def test_create_person_and_access_its_data(self):
@@ -84,6 +117,8 @@ class TestPerson(unittest.TestCase):
         self.assertEqual(person.email, email)
 
     def test_create_person_with_invalid_type_of_its_data(self):
+        enable_type_checking()
+        self.addCleanup(enable_type_checking, False)
         self.assertRaises(TypeError, Person, 10, 'a@mail.com')
         self.assertRaises(TypeError, Person, 'John Little', 10)
 
@@ -109,6 +144,12 @@ class TestPerson(unittest.TestCase):
         self.assertEqual(repr(person),
             "Person('John Little', 'john.little@gmail.com')")
 
+    def test_equivalent_persons_have_same_hash(self):
+        person1 = Person('John Little', 'john.little@gmail.com')
+        person2 = Person('John Little', 'john.little@gmail.com')
+        self.assertEqual(hash(person1), hash(person2))
+        self.assertEqual(len({person1, person2}), 1)
+
     def test_lt_gt(self):
         aa = Person('A', 'A@gmail.com')
         ab = Person('A', 'B@gmail.com')
@@ -119,6 +160,25 @@ class TestPerson(unittest.TestCase):
         self.assertGreaterEqual(ab, aa)
 
 
+class TestPersonRegistry(unittest.TestCase):
+    def test_first_person_is_registered(self):
+        persons = PersonRegistry()
+        person = Person('John Little', 'john.little@gmail.com')
+        self.assertIs(persons.intern(person), person)
+
+    def test_equivalent_persons_are_shared(self):
+        persons = PersonRegistry()
+        person1 = persons.intern(Person('John Little', 'john.little@gmail.com'))
+        person2 = persons.intern(Person('John Little', 'john.little@gmail.com'))
+        self.assertIs(person1, person2)
+
+    def test_different_persons_are_not_shared(self):
+        persons = PersonRegistry()
+        person1 = persons.intern(Person('John Little', 'john.little@gmail.com'))
+        person2 = persons.intern(Person('John Little', 'john.huge@gmail.com'))
+        self.assertIsNot(person1, person2)
+
+
 class TestWarningWithCulprit(unittest.TestCase):
     def test_create_warning_and_access_its_data(self):
         file = '/mnt/data/error.c'
@@ -134,6 +194,12 @@ class TestWarningWithCulprit(unittest.TestCase):
         self.assertEqual(warn_with_culprit.line, line)
         self.assertEqual(warn_with_culprit.text, text)
 
+    def test_warning_with_culprit_is_not_equivalent_to_warning(self):
+        warn = Warning('/mnt/data/error.c', 45, 'missing argument')
+        culprit = Person('John Little', 'john.little@gmail.com')
+        self.assertNotEqual(WarningWithCulprit(warn, culprit), warn)
+        self.assertNotEqual(warn, WarningWithCulprit(warn, culprit))
+
     def test_repr(self):
         file = '/mnt/data/error.c'
         line = 45
@@ -151,6 +217,8 @@ class TestWarningWithCulprit(unittest.TestCase):
 class TestParseWarnings(unittest.TestCase):
     def scenario_warnings_are_parsed_correctly(self, text, exp_warnings):
         self.assertEqual(parse_warnings(text), exp_warnings)
+        with TemporaryFile(text) as tf:
+            self.assertEqual(list(iter_warnings_mmap(tf.name)), exp_warnings)
 
     def create_warning_text_and_instance(self, path, line, text):
         warn_text = path + ':' + str(line) + ': warning: '+ text + '\n'
@@ -196,6 +264,67 @@ class TestParseWarnings(unittest.TestCase):
         exp_warnings = [warn]
         self.scenario_warnings_are_parsed_correctly(text, exp_warnings)
 
+    def test_parse_text_which_ends_with_white_space(self):
+        text, warn = self.create_warning_text_and_instance(
+            '/src/checking.h', 25, 'the following parameters are not documented:\n'
+            "\tparameter 'n'")
+        text = text + '  \n\t\n'
+        exp_warnings = [warn]
+        self.scenario_warnings_are_parsed_correctly(text, exp_warnings)
+
+
+    def test_parse_text_which_ends_with_white_space_and_blank_lines(self):
+        self.scenario_warnings_are_parsed_correctly(
+            '/src/checking.h:7: warning: x\n   \n\n',
+            [Warning('/src/checking.h', 7, 'x')])
+
+    def test_white_space_lines_inside_warning_are_kept(self):
+        self.scenario_warnings_are_parsed_correctly(
+            '/src/checking.h:7: warning: x\n   \n  y\n'
+            '/src/checking.c:8: warning: z\n',
+            [Warning('/src/checking.h', 7, 'x\n   \n  y'),
+             Warning('/src/checking.c', 8, 'z')])
+
+    def test_parse_text_with_crlf_line_endings(self):
+        text, warn = self.create_warning_text_and_instance(
+            '/src/checking.h', 25, 'the following parameters are not documented:\n'
+            "\tparameter 'n'")
+        text2, warn2 = self.create_warning_text_and_instance(
+            '/src/checking.c', 34, 'include file error.h not found')
+        text = (text + text2).replace('\n', '\r\n')
+        exp_warnings = [warn, warn2]
+        self.scenario_warnings_are_parsed_correctly(text, exp_warnings)
+
+class TestIterWarnings(unittest.TestCase):
+    def test_warnings_are_generated_from_file_object(self):
+        text = ('/src/checking.h:25: warning: missing argument\n'
+                '/src/checking.c:34: warning: the following parameters are not documented:\n'
+                "  parameter 'n'\n")
+        self.assertEqual(list(iter_warnings(StringIO(text))), [
+            Warning('/src/checking.h', 25, 'missing argument'),
+            Warning('/src/checking.c', 34,
+                "the following parameters are not documented:\n"
+                "  parameter 'n'")])
+
+    def test_warnings_from_same_file_share_path(self):
+        text = ('/src/checking.h:25: warning: missing argument\n'
+                '/src/checking.h:34: warning: missing parameter\n')
+        warn1, warn2 = iter_warnings(StringIO(text))
+        self.assertIs(warn1.file, warn2.file)
+        with TemporaryFile(text) as tf:
+            warn1, warn2 = iter_warnings_mmap(tf.name)
+        self.assertIs(warn1.file, warn2.file)
+
+    def test_warnings_are_generated_before_whole_input_is_read(self):
+        def lines():
+            yield '/src/checking.h:25: warning: missing argument\n'
+            yield '/src/checking.c:34: warning: missing parameter\n'
+            self.fail('the input was read too far')
+
+        gen = iter_warnings(lines())
+        self.assertEqual(next(gen),
+            Warning('/src/checking.h', 25, 'missing argument'))
+
 
 class TestGroupByCulprit(unittest.TestCase):
     def create_warning_and_culprit(self, culprit_name):
@@ -236,3 +365,54 @@ class TestGroupByCulprit(unittest.TestCase):
         self.assertEqual(next(gen), (culprit2, [warn3, warn4]))
         self.assertEqual(next(gen), (culprit1, [warn1, warn2]))
         self.assertRaises(StopIteration, next, gen)
+
+
+class TestCulpritGrouper(unittest.TestCase):
+    def create_warning(self, culprit_name, line=45):
+        warn = Warning('/mnt/data/error.c', line, 'missing argument')
+        return WarningWithCulprit(warn,
+            Person(culprit_name, 'generic@gmail.com'))
+
+    def test_groups_are_empty_when_nothing_has_been_added(self):
+        grouper = CulpritGrouper()
+        self.assertEqual(list(grouper.groups()), [])
+        self.assertEqual(len(grouper), 0)
+
+    def test_warnings_are_grouped_by_equivalent_culprits(self):
+        warn1 = self.create_warning('John Little', 1)
+        warn2 = self.create_warning('John Little', 2)
+        grouper = CulpritGrouper()
+        grouper.add(warn1)
+        grouper.add(warn2)
+        self.assertEqual(list(grouper.groups()),
+            [(warn1.culprit, [warn1, warn2])])
+        self.assertEqual(len(grouper), 1)
+
+    def test_groups_are_sorted_by_culprit(self):
+        warn1 = self.create_warning('John Little')
+        warn2 = self.create_warning('Jane Book')
+        grouper = CulpritGrouper()
+        grouper.add_all([warn1, warn2])
+        self.assertEqual([culprit.name for culprit, _ in grouper.groups()],
+            ['Jane Book', 'John Little'])
+
+    def test_warnings_can_be_added_after_groups_are_obtained(self):
+        warn1 = self.create_warning('John Little', 1)
+        warn2 = self.create_warning('John Little', 2)
+        grouper = CulpritGrouper()
+        grouper.add(warn1)
+        groups = list(grouper.groups())
+        grouper.add(warn2)
+        self.assertEqual(groups, [(warn1.culprit, [warn1])])
+        self.assertEqual(list(grouper.groups()),
+            [(warn1.culprit, [warn1, warn2])])
+
+    def test_warnings_are_added_as_they_are_generated(self):
+        def warnings():
+            yield self.create_warning('John Little')
+            self.assertEqual(len(grouper), 1)
+            yield self.create_warning('Jane Book')
+
+        grouper = CulpritGrouper()
+        grouper.add_all(warnings())
+        self.assertEqual(len(grouper), 2)